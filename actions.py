@@ -1,12 +1,16 @@
 from __future__ import annotations
 
 import hashlib
+import os
 import secrets
 from typing import Optional
 
 from flask import render_template, request, redirect, session, abort
 
-from helpers import execute_cmd, run_query, validate_credentials, validate_input_recipe, create_log
+from images import schedule_variants
+from similar import schedule_similar
+from helpers import (execute_cmd, transaction, validate_credentials, validate_input_recipe, create_log,
+                     clear_loaders, sniff_image_type, get_categories, category_exists, recipe_cache)
 
 
 def create_account_action(
@@ -28,16 +32,15 @@ def create_account_action(
     if len(password) > max_password_len:
         return render_template("createAccount.html", error=f"Password must be at most {max_password_len} characters long")
 
-    # Injection fix
-    # existing_user = run_query("SELECT id, username, password FROM users WHERE username = ?", [username])
-    existing_user = run_query("SELECT id, username, password FROM users WHERE username = '" + username + "'", [])
-    if len(existing_user) > 0:
-        return render_template("createAccount.html", error="Username already exists")
-
+    # The unique username index decides: a taken name inserts nothing, even when two signups race
     # Hash fix,
     # hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    # execute_cmd("INSERT INTO users (username, password) VALUES (?, ?)", [username, hashed_password])
-    execute_cmd("INSERT INTO users (username, password) VALUES (?, ?)", [username, password])
+    # cur = execute_cmd("INSERT INTO users (username, password) VALUES (?, ?) ON CONFLICT (username) DO NOTHING",
+    #                   [username, hashed_password])
+    cur = execute_cmd("INSERT INTO users (username, password) VALUES (?, ?) ON CONFLICT (username) DO NOTHING",
+                      [username, password])
+    if cur.rowcount == 0:
+        return render_template("createAccount.html", error="Username already exists")
 
     return redirect("/login")
 
@@ -64,6 +67,13 @@ def logout_action():
     return redirect("/")
 
 
+def _create_recipe_error(error: str, selected_category_id: Optional[int]):
+    return render_template("createRecipe.html",
+                           error=error,
+                           categories=get_categories(),
+                           selected_category_id=selected_category_id)
+
+
 def create_recipe_post_action(
     min_recipe_name_len: int,
     max_recipe_name_len: int,
@@ -71,6 +81,7 @@ def create_recipe_post_action(
     max_ingredients_len: int,
     min_directions_len: int,
     max_directions_len: int,
+    max_cover_size: int,
 ):
     name = request.form.get('name')
     ingredients = request.form.get('ingredients')
@@ -81,37 +92,25 @@ def create_recipe_post_action(
     except (TypeError, ValueError):
         category_id = 0
 
-    cat_exists = run_query("SELECT id FROM categories WHERE id = ? LIMIT 1", [category_id])
-    if not cat_exists:
-        return render_template("createRecipe.html",
-                               error="Invalid category selected",
-                               categories=run_query("SELECT id, name FROM categories ORDER BY name"),
-                               selected_category_id=None)
+    if not category_exists(category_id):
+        return _create_recipe_error("Invalid category selected", None)
 
     file = request.files.get('cover')
-    image_bytes = None
+    image_size = 0
     mime_type = None
     if file and file.filename:
-        data = file.read()
-        if len(data) > 5 * 1024 * 1024:
-            return render_template("createRecipe.html", error="Image too large (max 5MB)",
-                                   categories=run_query("SELECT id, name FROM categories ORDER BY name"),
-                                   selected_category_id=category_id)
-        header = data[:12]
-        if header.startswith(b"\xff\xd8\xff"):
-            mime_type = "image/jpeg"
-        elif header.startswith(b"\x89PNG\r\n\x1a\n"):
-            mime_type = "image/png"
-        elif header.startswith(b"GIF87a") or header.startswith(b"GIF89a"):
-            mime_type = "image/gif"
-        elif header[:4] == b"RIFF" and header[8:12] == b"WEBP":
-            mime_type = "image/webp"
-        else:
-            return render_template("createRecipe.html",
-                                   error="Unsupported image format. Use JPG, PNG, GIF, or WebP.",
-                                   categories=run_query("SELECT id, name FROM categories ORDER BY name"),
-                                   selected_category_id=category_id)
-        image_bytes = data
+        # Werkzeug spools uploads to a temporary file, so only the header is ever read into memory here
+        stream = file.stream
+        image_size = stream.seek(0, os.SEEK_END)
+        stream.seek(0)
+        if image_size > max_cover_size:
+            file.close()
+            return _create_recipe_error(f"Image too large (max {max_cover_size // (1024 * 1024)}MB)", category_id)
+        mime_type = sniff_image_type(stream.read(12))
+        stream.seek(0)
+        if mime_type is None:
+            file.close()
+            return _create_recipe_error("Unsupported image format. Use JPG, PNG, GIF, or WebP.", category_id)
 
     has_issue, error_message = validate_input_recipe(
         name, ingredients, directions,
@@ -121,20 +120,34 @@ def create_recipe_post_action(
     )
 
     if has_issue:
-        return render_template("createRecipe.html",
-                               error=error_message,
-                               categories=run_query("SELECT id, name FROM categories ORDER BY name"),
-                               selected_category_id=category_id)
+        if file:
+            file.close()
+        return _create_recipe_error(error_message, category_id)
 
-    cur = execute_cmd(
-        "INSERT INTO recipes (name, ingredients, directions, user_id, category_id) VALUES (?, ?, ?, ?, ?)",
-        [name, ingredients, directions, session["user_id"], category_id]
-    )
-    recipe_id = cur.lastrowid
+    user_id = session["user_id"]
+
+    # The recipe and its cover are committed together, or not at all
+    def create(tx):
+        new_id = tx.execute(
+            "INSERT INTO recipes (name, ingredients, directions, user_id, category_id) VALUES (?, ?, ?, ?, ?)",
+            [name, ingredients, directions, user_id, category_id]
+        ).lastrowid
+        if mime_type is not None:
+            tx.execute("INSERT INTO recipe_images (recipe_id, image, mime_type) VALUES (?, zeroblob(?), ?)",
+                       [new_id, image_size, mime_type])
+            content_hash = tx.write_blob("recipe_images", "image", new_id, file.stream)
+            tx.execute("UPDATE recipe_images SET content_hash = ? WHERE recipe_id = ?", [content_hash, new_id])
+        return new_id
 
-    if image_bytes is not None:
-        execute_cmd("INSERT OR REPLACE INTO recipe_images (recipe_id, image, mime_type) VALUES (?, ?, ?)",
-                    [recipe_id, image_bytes, mime_type])
+    try:
+        recipe_id = transaction(create)
+    finally:
+        if file:
+            file.close()
+
+    if mime_type is not None:
+        schedule_variants(recipe_id)
+    schedule_similar(recipe_id)
 
     return redirect("/")
 
@@ -148,6 +161,8 @@ def delete_recipe_action():
     # Issue 1. Broken access control for deleting recipe.
     # execute_cmd("DELETE FROM recipes WHERE id = ? AND user_id = ?", [recipe_id, user_id])
     execute_cmd("DELETE FROM recipes WHERE id = ?", [recipe_id])
+    recipe_cache.invalidate(recipe_id)
+    schedule_similar(recipe_id)
 
     return redirect("/account")
 
@@ -182,14 +197,13 @@ def edit_recipe_post_action(
         return render_template("editRecipe.html",
                                error=error_message,
                                recipe=(recipe_id, name, ingredients, directions, category_id),
-                               categories=run_query("SELECT id, name FROM categories ORDER BY name"),
+                               categories=get_categories(),
                                selected_category_id=category_id)
 
-    cat_exists = run_query("SELECT id FROM categories WHERE id = ? LIMIT 1", [category_id])
-    if not cat_exists:
+    if not category_exists(category_id):
         return render_template("editRecipe.html", error="Invalid category selected",
                                recipe=(recipe_id, name, ingredients, directions, category_id),
-                               categories=run_query("SELECT id, name FROM categories ORDER BY name"),
+                               categories=get_categories(),
                                selected_category_id=category_id)
 
     cur = execute_cmd(
@@ -197,6 +211,8 @@ def edit_recipe_post_action(
         [name, ingredients, directions, category_id, recipe_id, user_id])
     if cur.rowcount == 0:
         abort(404)
+    recipe_cache.invalidate(recipe_id)
+    schedule_similar(recipe_id)
 
     return redirect("/account")
 
@@ -211,26 +227,22 @@ def rate_action():
     if rating < 1 or rating > 5:
         abort(400)
 
-    author_check = run_query("SELECT user_id FROM recipes WHERE id = ? LIMIT 1", [recipe_id])
-    if author_check and author_check[0] and author_check[0][0] == session["user_id"]:
-        abort(403)
-
     user_id = session["user_id"]
 
-    existing = run_query(
-        "SELECT id FROM ratings WHERE recipe_id = ? AND user_id = ? LIMIT 1",
-        [recipe_id, user_id]
+    # One upsert: the SELECT skips recipes that do not exist or belong to the rater,
+    # and a second rating by the same user replaces the first
+    cur = execute_cmd(
+        """
+        INSERT INTO ratings (rating, recipe_id, user_id)
+        SELECT ?, id, ? FROM recipes WHERE id = ? AND user_id IS NOT ?
+        ON CONFLICT (recipe_id, user_id) DO UPDATE SET rating = excluded.rating
+        """,
+        [rating, user_id, recipe_id, user_id]
     )
-    if existing:
-        execute_cmd(
-            "UPDATE ratings SET rating = ? WHERE recipe_id = ? AND user_id = ?",
-            [rating, recipe_id, user_id]
-        )
-    else:
-        execute_cmd(
-            "INSERT INTO ratings (rating, recipe_id, user_id) VALUES (?, ?, ?)",
-            [rating, recipe_id, user_id]
-        )
+    if cur.rowcount == 0:
+        abort(403)
+    clear_loaders()
+    recipe_cache.invalidate(recipe_id)
 
     return redirect(f"/recipes/{recipe_id}")
 
@@ -247,6 +259,7 @@ def add_comment_action(min_comment_len: int, max_comment_len: int):
     execute_cmd(
         "INSERT INTO comments (content, recipe_id, user_id) VALUES (?, ?, ?)",
         [comment, recipe_id, session["user_id"]])
+    recipe_cache.invalidate(recipe_id)
 
     return redirect(f"/recipes/{recipe_id}")
 
@@ -259,5 +272,6 @@ def delete_comment_action():
     user_id = session["user_id"]
 
     execute_cmd("DELETE FROM comments WHERE id = ? AND recipe_id = ? AND user_id = ?", [comment_id, recipe_id, user_id])
+    recipe_cache.invalidate(recipe_id)
 
     return redirect(f"/recipes/{recipe_id}")
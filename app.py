@@ -1,12 +1,33 @@
-from flask import Flask, render_template, request, redirect, session, abort, make_response
+import hashlib
+import hmac
+import json
+import os
 
+from flask import Flask, Response, render_template, request, redirect, session, abort, make_response
+from markupsafe import Markup
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import metrics
 from formatting import format_timestamp
-from helpers import execute_cmd, run_query, get_avg_rating
+from helpers import (run_query, add_visit, get_avg_rating, get_avg_ratings, get_user_ratings, build_fts_query,
+                     encode_cursor, decode_cursor, stream_blob, get_categories, recipe_cache, metrics_gauges,
+                     init_app as init_db)
+from assets import init_app as init_assets
+from bulk import init_app as init_bulk
+from compression import init_app as init_compression
+from images import plan_cover_response, init_app as init_images
+from similar import init_app as init_similar
 from actions import (create_account_action, signin_action, logout_action, create_recipe_post_action,
                      edit_recipe_post_action, rate_action, add_comment_action,
                      delete_comment_action, delete_recipe_action)
 
 app = Flask(__name__)
+init_db(app)
+init_images(app)
+init_bulk(app)
+init_assets(app)
+init_compression(app)
+init_similar(app)
 
 app.jinja_env.globals["format_timestamp"] = format_timestamp
 app.config['SECRET_KEY'] = '8c6976e5b5410415bde908bd4dee15dfb167a9c873fc4bb8a81f6f2ab448a918'
@@ -15,7 +36,11 @@ app.config.update(
     SESSION_COOKIE_HTTPONLY=True,
     SESSION_COOKIE_SAMESITE='Lax',
     SESSION_COOKIE_SECURE=False,
-    PERMANENT_SESSION_LIFETIME=60 * 60 * 24 * 7
+    PERMANENT_SESSION_LIFETIME=60 * 60 * 24 * 7,
+    # Adds an X-DB-Time header with the request's SQL time and statement count
+    DB_TIMING_HEADER=os.environ.get("DB_TIMING_HEADER") == "1",
+    # Bearer token for scraping /metrics; without one only signed-in users can read it
+    METRICS_TOKEN=os.environ.get("METRICS_TOKEN"),
 )
 
 MIN_USERNAME_LEN = 4
@@ -30,6 +55,42 @@ MIN_INGREDIENTS_LEN = 10
 MAX_INGREDIENTS_LEN = 5000
 MIN_DIRECTIONS_LEN = 10
 MAX_DIRECTIONS_LEN = 10000
+MAX_COVER_SIZE = 5 * 1024 * 1024
+# Room for the text fields of the recipe form on top of the cover image
+MAX_FORM_OVERHEAD = 64 * 1024
+
+# Oversized requests are rejected with 413 before the body is read
+app.config["MAX_CONTENT_LENGTH"] = MAX_COVER_SIZE + MAX_FORM_OVERHEAD
+
+# bm25 column weights for recipes_fts (name, ingredients, directions); name matches rank highest
+SEARCH_WEIGHTS = (10.0, 2.0, 1.0)
+# /recipes counts matches exactly up to this many and shows "N+" beyond it
+RESULT_COUNT_CAP = 1000
+COMMENTS_PER_PAGE = 20
+# JSON API: page sizes for /api/recipes, and rows fetched per query while streaming NDJSON
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+API_STREAM_CHUNK = 500
+# Fields selectable with ?fields=, mapped to their SQL expression and the join they need
+API_FIELDS = {
+    "id": ("r.id", None),
+    "name": ("r.name", None),
+    "ingredients": ("r.ingredients", None),
+    "directions": ("r.directions", None),
+    "user_id": ("r.user_id", None),
+    "author": ("u.username", "JOIN users u ON u.id = r.user_id"),
+    "category_id": ("r.category_id", None),
+    "category": ("c.name", None),
+    "snippet": ("r.snippet", None),
+    "directions_snippet": ("r.directions_snippet", None),
+    "ingredient_count": ("r.ingredient_count", None),
+    "text_length": ("r.text_length", None),
+    "has_image": ("EXISTS(SELECT 1 FROM recipe_images i WHERE i.recipe_id = r.id)", None),
+    "avg_rating": ("COALESCE(s.avg_rating, 0)", "LEFT JOIN recipe_stats s ON s.recipe_id = r.id"),
+    "rating_count": ("COALESCE(s.rating_count, 0)", "LEFT JOIN recipe_stats s ON s.recipe_id = r.id"),
+    "comment_count": ("COALESCE(s.comment_count, 0)", "LEFT JOIN recipe_stats s ON s.recipe_id = r.id"),
+}
+API_LIST_FIELDS = ("id", "name", "user_id", "category_id", "category", "avg_rating", "rating_count")
 
 
 def require_login():
@@ -49,32 +110,45 @@ def check_csrf():
     #    abort(403)
 
 
-def add_visits():
-    execute_cmd("INSERT INTO visits (last_visit) VALUES (datetime('now'))")
-
-
 @app.route("/")
 def index():
-    add_visits()
+    add_visit()
 
     top_recipes = run_query(
         """
         SELECT r.id,
                r.name,
-               r.ingredients,
-               r.directions,
-               ROUND(AVG(rt.rating), 1) AS avg_rating,
-               COUNT(rt.id)             AS ratings_count
-        FROM recipes r
-                 LEFT JOIN ratings rt ON rt.recipe_id = r.id
-        GROUP BY r.id, r.name, r.ingredients, r.directions
-        ORDER BY COALESCE(AVG(rt.rating), 0) DESC, COUNT(rt.id) DESC, r.id DESC LIMIT 3
+               r.snippet,
+               r.ingredient_count,
+               CASE WHEN s.rating_count > 0 THEN ROUND(s.avg_rating, 1) END AS avg_rating,
+               s.rating_count                                            AS ratings_count
+        FROM recipe_stats s
+                 JOIN recipes r INDEXED BY idx_recipes_list ON r.id = s.recipe_id
+        ORDER BY s.avg_rating DESC, s.rating_count DESC, s.recipe_id DESC LIMIT 3
         """
     )
 
     return render_template("index.html", top_recipes=top_recipes)
 
 
+def require_metrics_access():
+    token = app.config["METRICS_TOKEN"]
+    if not token:
+        require_login()
+        return
+    supplied = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode()):
+        abort(403)
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    require_metrics_access()
+    resp = make_response(metrics.render(metrics_gauges()))
+    resp.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return resp
+
+
 @app.route("/create_account", methods=["GET", "POST"])
 def create_account():
     if request.method == "POST":
@@ -125,67 +199,99 @@ def create_recipe():
             MAX_INGREDIENTS_LEN,
             MIN_DIRECTIONS_LEN,
             MAX_DIRECTIONS_LEN,
+            MAX_COVER_SIZE,
         )
 
-    cats = run_query("SELECT id, name FROM categories ORDER BY name")
+    cats = get_categories()
     return render_template("createRecipe.html", categories=cats, selected_category_id=None)
 
 
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(_error):
+    if request.path != "/create_recipe":
+        return "Request too large", 413
+    cats = get_categories()
+    return render_template("createRecipe.html", error=f"Image too large (max {MAX_COVER_SIZE // (1024 * 1024)}MB)",
+                           categories=cats, selected_category_id=None), 413
+
+
 @app.route("/recipes")
 def recipes():
     require_login()
     q = request.args.get("q", "", type=str)
     cat_id = request.args.get("cat", "", type=str)
-    page = request.args.get("page", 1, type=int) or 1
+    after = decode_cursor(request.args.get("after", "", type=str), 2)
+    before = decode_cursor(request.args.get("before", "", type=str), 2)
+    last = request.args.get("last", "", type=str) == "1"
     per_page = 10
 
-    params = []
-    where_clauses = []
+    from_sql, where_clauses, params, score_sql = recipe_filters(q, cat_id)
+
+    # Results are ordered by (score ASC, id DESC). Walking backwards (before/last) flips the
+    # order and the keyset comparison, and the fetched rows are reversed afterwards.
+    backwards = before is not None or (last and after is None)
+    cursor = before if before is not None else after
+    keyset_clauses = list(where_clauses)
+    keyset_params = list(params)
+    if cursor is not None:
+        score, last_id = cursor
+        cmp_score, cmp_id = (">", "<") if not backwards else ("<", ">")
+        if q:
+            keyset_clauses.append(f"(score {cmp_score} ? OR (score = ? AND r.id {cmp_id} ?))")
+            keyset_params.extend([score, score, last_id])
+        else:
+            keyset_clauses.append(f"r.id {cmp_id} ?")
+            keyset_params.append(last_id)
     if q:
-        pattern = f"%{q}%"
-        where_clauses.append("(r.name LIKE ? OR r.ingredients LIKE ? OR r.directions LIKE ?)")
-        params.extend([pattern, pattern, pattern])
-    if cat_id and cat_id.isdigit():
-        where_clauses.append("r.category_id = ?")
-        params.append(int(cat_id))
-
+        order_sql = "score, r.id DESC" if not backwards else "score DESC, r.id"
+    else:
+        # Every score is 0 without a search; ordering by id alone walks the list index instead of sorting
+        order_sql = "r.id DESC" if not backwards else "r.id"
     where_sql = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+    keyset_sql = f"WHERE {' AND '.join(keyset_clauses)}" if keyset_clauses else ""
 
-    # Count total results for pagination
+    # Exact count up to RESULT_COUNT_CAP, shown as "N+" beyond that
     total_row = run_query(
         f"""
         SELECT COUNT(*)
-        FROM recipes r
-        JOIN categories c ON c.id = r.category_id
-        {where_sql}
+        FROM (SELECT 1
+              FROM {from_sql}
+              JOIN categories c ON c.id = r.category_id
+              {where_sql}
+              LIMIT ?)
         """,
-        params
+        params + [RESULT_COUNT_CAP + 1]
     )
     total_count = total_row[0][0] if total_row else 0
-    total_pages = max(1, (total_count + per_page - 1) // per_page)
-
-    page = max(page, 1)
-    page = min(page, total_pages)
-
-    offset = (page - 1) * per_page
+    count_capped = total_count > RESULT_COUNT_CAP
+    total_count = min(total_count, RESULT_COUNT_CAP)
 
     rec = run_query(
         f"""
-        SELECT r.id, r.name, r.ingredients, r.directions, r.user_id, r.category_id, c.name AS category_name
-        FROM recipes r
+        SELECT r.id, r.name, r.snippet, r.directions_snippet, r.category_id, c.name AS category_name,
+               {score_sql} AS score
+        FROM {from_sql}
         JOIN categories c ON c.id = r.category_id
-        {where_sql}
-        ORDER BY r.id DESC
-        LIMIT ? OFFSET ?
+        {keyset_sql}
+        ORDER BY {order_sql}
+        LIMIT ?
         """,
-        params + [per_page, offset]
+        keyset_params + [per_page + 1]
     )
 
-    ratings = {r[0]: get_avg_rating(r[0]) for r in rec}
-    cats = run_query("SELECT id, name FROM categories ORDER BY name")
+    has_more = len(rec) > per_page
+    rec = rec[:per_page]
+    if backwards:
+        rec.reverse()
+        has_prev, has_next = has_more, before is not None
+    else:
+        has_prev, has_next = after is not None, has_more
+
+    prev_cursor = encode_cursor(rec[0][6], rec[0][0]) if rec and has_prev else None
+    next_cursor = encode_cursor(rec[-1][6], rec[-1][0]) if rec and has_next else None
 
-    start_idx = (page - 1) * per_page + 1 if total_count > 0 else 0
-    end_idx = min(page * per_page, total_count)
+    ratings = get_avg_ratings([r[0] for r in rec])
+    cats = get_categories()
 
     return render_template(
         "recipes.html",
@@ -194,15 +300,38 @@ def recipes():
         ratings=ratings,
         categories=cats,
         selected_cat_id=(int(cat_id) if str(cat_id).isdigit() else None),
-        page=page,
         per_page=per_page,
-        total_pages=total_pages,
         total_count=total_count,
-        start_idx=start_idx,
-        end_idx=end_idx,
+        count_capped=count_capped,
+        prev_cursor=prev_cursor,
+        next_cursor=next_cursor,
     )
 
 
+def recipe_filters(q: str, cat_id: str):
+    """
+    Builds the FROM clause, WHERE conditions, parameters and relevance expression for a
+    recipe search (q) and category filter (cat_id), shared by /recipes and /api/recipes.
+    Without a search every recipe scores 0.
+    """
+    params = []
+    where_clauses = []
+    from_sql = "recipes r"
+    score_sql = "0"
+    if q:
+        match = build_fts_query(q)
+        # Look matches up in the covering list index rather than the wide recipe rows
+        from_sql = "recipes_fts f JOIN recipes r INDEXED BY idx_recipes_list ON r.id = f.rowid"
+        where_clauses.append("recipes_fts MATCH ?")
+        # Input without any searchable words matches nothing, same as an empty phrase
+        params.append(match or '""')
+        score_sql = "bm25(recipes_fts, {}, {}, {})".format(*SEARCH_WEIGHTS)
+    if cat_id and cat_id.isdigit():
+        where_clauses.append("r.category_id = ?")
+        params.append(int(cat_id))
+    return from_sql, where_clauses, params, score_sql
+
+
 @app.route("/recipes/delete", methods=["POST"])
 def delete_recipe():
 
@@ -218,23 +347,11 @@ def account():
     username = session.get("username", "User")
     my_recipes = run_query("SELECT id, name FROM recipes WHERE user_id = ? ORDER BY name", [user_id])
 
-    recipes_count = len(my_recipes)
-
-    avg_rating_row = run_query("""
-                               SELECT AVG(rt.rating)
-                               FROM ratings rt
-                                        JOIN recipes r ON rt.recipe_id = r.id
-                               WHERE r.user_id = ?
-                               """, [user_id])
-    avg_rating = avg_rating_row[0][0] if avg_rating_row and avg_rating_row[0][0] is not None else 0
-
-    comments_count_row = run_query("""
-                                   SELECT COUNT(*)
-                                   FROM comments c
-                                            JOIN recipes r ON c.recipe_id = r.id
-                                   WHERE r.user_id = ?
-                                   """, [user_id])
-    comments_count = comments_count_row[0][0] if comments_count_row else 0
+    # Totals are kept current by triggers, so this is one row however popular the recipes are
+    stats = run_query("SELECT recipe_count, rating_sum, rating_count, comment_count FROM user_stats WHERE user_id = ?",
+                      [user_id])
+    recipes_count, rating_sum, rating_count, comments_count = stats[0] if stats else (0, 0, 0, 0)
+    avg_rating = rating_sum / rating_count if rating_count else 0
 
     return render_template("account.html", username=username, recipes=my_recipes,
                            recipes_count=recipes_count, avg_rating=avg_rating, comments_count=comments_count)
@@ -264,7 +381,7 @@ def edit_recipe(recipe_id: int):
     if len(result) == 0:
         abort(404)
 
-    cats = run_query("SELECT id, name FROM categories ORDER BY name")
+    cats = get_categories()
     return render_template("editRecipe.html", recipe=result[0], categories=cats, selected_category_id=result[0][4])
 
 
@@ -279,6 +396,40 @@ def rate():
 @app.route("/recipes/<int:recipe_id>", methods=["GET"])
 def recipe(recipe_id: int):
     require_login()
+    user_id = session["user_id"]
+
+    # A page only differs between viewers by who is looking and their form token, so a
+    # cached entry plus those identifies the response without touching the database
+    cached = recipe_cache.peek(recipe_id)
+    if cached is not None and request.if_none_match.contains_weak(recipe_etag(cached, user_id)):
+        return make_response("", 304)
+
+    entry = recipe_cache.get(recipe_id, build_recipe_page)
+    if entry is None:
+        abort(404)
+
+    user_rating = get_user_ratings(user_id, [recipe_id])[recipe_id]
+
+    recipe_tuple = entry["recipe"]
+    resp = make_response(render_template("recipe.html",
+                                         recipe=recipe_tuple,
+                                         recipe_body=entry["body_html"],
+                                         avg_rating=entry["rating"][0],
+                                         ratings_count=entry["rating"][1],
+                                         user_rating=user_rating,
+                                         comments=entry["comments"],
+                                         comments_cursor=entry["comments_cursor"],
+                                         similar=entry["similar"],
+                                         recipe_id=recipe_id,
+                                         author_id=recipe_tuple[4],
+                                         author_name=recipe_tuple[5],
+                                         category_name=recipe_tuple[8]))
+    resp.set_etag(recipe_etag(entry, user_id))
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+def build_recipe_page(recipe_id: int):
     result = run_query(
         """
         SELECT r.id,
@@ -298,38 +449,72 @@ def recipe(recipe_id: int):
         [recipe_id]
     )
     if len(result) == 0:
-        abort(404)
-
-    rating = get_avg_rating(recipe_id)
+        return None
 
-    user_rating_row = run_query("SELECT rating FROM ratings WHERE recipe_id = ? AND user_id = ? LIMIT 1",
-                                [recipe_id, session["user_id"]])
-    user_rating = user_rating_row[0][0] if user_rating_row else None
+    comments, comments_cursor = fetch_comments(recipe_id)
+    # Precomputed by similar.py, read through the recipe_similar primary key
+    similar = run_query(
+        """
+        SELECT r.id, r.name, r.snippet
+        FROM recipe_similar s
+                 JOIN recipes r ON r.id = s.similar_id
+        WHERE s.recipe_id = ?
+        ORDER BY s.score DESC
+        """,
+        [recipe_id]
+    )
 
+    return {
+        "recipe": result[0],
+        "rating": get_avg_rating(recipe_id),
+        "comments": comments,
+        "comments_cursor": comments_cursor,
+        "similar": similar,
+        "body_html": Markup(render_template("recipeBody.html", recipe=result[0])),
+    }
+
+
+def fetch_comments(recipe_id: int, before_id=None):
+    """
+    Returns one page of a recipe's comments, newest first, and the cursor for the next
+    (older) page or None if this is the last one. Served by idx_comments_recipe_id.
+    """
+    params = [recipe_id]
+    before_sql = ""
+    if before_id is not None:
+        before_sql = "AND c.id < ?"
+        params.append(before_id)
     comments = run_query(
-        """
+        f"""
         SELECT c.id, c.content, u.username, c.user_id, c.created_at
         FROM comments c
                  JOIN users u ON u.id = c.user_id
-        WHERE c.recipe_id = ?
+        WHERE c.recipe_id = ? {before_sql}
         ORDER BY c.id DESC
+        LIMIT ?
         """,
-        [recipe_id]
+        params + [COMMENTS_PER_PAGE + 1]
     )
+    if len(comments) > COMMENTS_PER_PAGE:
+        comments = comments[:COMMENTS_PER_PAGE]
+        return comments, encode_cursor(comments[-1][0])
+    return comments, None
+
+
+@app.route("/recipes/<int:recipe_id>/comments", methods=["GET"])
+def recipe_comments(recipe_id: int):
+    require_login()
+    before = decode_cursor(request.args.get("before", "", type=str), 1)
+    comments, next_cursor = fetch_comments(recipe_id, before[0] if before else None)
+    resp = make_response(render_template("commentItems.html", comments=comments, recipe_id=recipe_id))
+    if next_cursor:
+        resp.headers["X-Next-Cursor"] = next_cursor
+    return resp
+
 
-    recipe_tuple = result[0]
-    author_id = recipe_tuple[4]
-    author_name = recipe_tuple[5]
-    category_name = recipe_tuple[8]
-    return render_template("recipe.html",
-                           recipe=recipe_tuple,
-                           avg_rating=rating[0],
-                           ratings_count=rating[1],
-                           user_rating=user_rating,
-                           comments=comments,
-                           author_id=author_id,
-                           author_name=author_name,
-                           category_name=category_name)
+def recipe_etag(entry, user_id: int) -> str:
+    key = f"{entry['token']}:{user_id}:{session.get('csrf_token', '')}"
+    return hashlib.sha256(key.encode()).hexdigest()
 
 
 @app.route("/comment", methods=["POST"])
@@ -350,23 +535,146 @@ def delete_comment():
 @app.route("/recipes/<int:recipe_id>/cover", methods=["GET"])
 def recipe_cover(recipe_id: int):
     require_login()
-    row = run_query("SELECT image, mime_type FROM recipe_images WHERE recipe_id = ? LIMIT 1", [recipe_id])
-    if not row:
+    plan = plan_cover_response(recipe_id, request.args.get("size", "original", type=str),
+                               request.headers.get("If-None-Match"), request.headers.get("Range"))
+    if plan is None:
         abort(404)
-    data: bytes = row[0][0]
-    ctype = row[0][1] or "application/octet-stream"
-
-    if ctype == "application/octet-stream":
-        if data.startswith(b"\xff\xd8\xff"):
-            ctype = "image/jpeg"
-        elif data.startswith(b"\x89PNG\r\n\x1a\n"):
-            ctype = "image/png"
-        elif data.startswith(b"GIF87a") or data.startswith(b"GIF89a"):
-            ctype = "image/gif"
-        elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
-            ctype = "image/webp"
-
-    resp = make_response(data)
-    resp.headers["Content-Type"] = ctype
-    resp.headers["Cache-Control"] = "public, max-age=86400"
+    status, headers, body = plan
+    resp = Response(stream_blob(*body) if body else b"", status=status)
+    resp.headers.update(headers)
     return resp
+
+
+def api_fields(default):
+    """Parses ?fields=a,b into a tuple of API_FIELDS names, aborting with 400 on unknown ones."""
+    raw = request.args.get("fields", "", type=str)
+    fields = tuple(dict.fromkeys(f.strip() for f in raw.split(",") if f.strip())) or default
+    if any(f not in API_FIELDS for f in fields):
+        abort(400)
+    return fields
+
+
+def api_projection(fields):
+    """
+    Returns the SELECT list and the extra joins for the requested fields, and a function
+    turning a result row into the JSON object. Columns are always selected in API_FIELDS
+    order, so each set of fields is one statement shape whatever order the client asks
+    for; only the JSON follows the requested order.
+    """
+    selected = [f for f in API_FIELDS if f in fields]
+    columns = ", ".join(API_FIELDS[f][0] for f in selected)
+    joins = " ".join(dict.fromkeys(API_FIELDS[f][1] for f in selected if API_FIELDS[f][1]))
+
+    def to_item(row):
+        values = dict(zip(selected, row))
+        return {f: values[f] for f in fields}
+
+    return columns, joins, to_item
+
+
+def json_response(body: str, mimetype="application/json"):
+    # The body is built anyway, so hashing it gives a validator that only changes with the data
+    resp = Response(body, mimetype=mimetype)
+    resp.set_etag(hashlib.sha256(body.encode()).hexdigest())
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp.make_conditional(request)
+
+
+@app.route("/api/recipes", methods=["GET"])
+def api_recipes():
+    """
+    Lists recipes as JSON, filtered like /recipes (q, cat) and walked in a stable order:
+    by relevance then id when searching, otherwise by id, so a client that keeps the last
+    next_cursor picks up new recipes on its next sync.
+
+    format=ndjson (or Accept: application/x-ndjson) streams every matching recipe, or up
+    to limit, one object per line, followed by a {"next_cursor", "has_more"} line.
+    Otherwise one page of limit recipes is returned with an ETag.
+    """
+    require_login()
+    fields = api_fields(API_LIST_FIELDS)
+    q = request.args.get("q", "", type=str)
+    cat_id = request.args.get("cat", "", type=str)
+    after = decode_cursor(request.args.get("after", "", type=str), 2)
+    limit = request.args.get("limit", type=int)
+    ndjson = (request.args.get("format") == "ndjson"
+              or request.accept_mimetypes.best == "application/x-ndjson")
+
+    from_sql, where_clauses, params, score_sql = recipe_filters(q, cat_id)
+    columns, joins, to_item = api_projection(fields)
+    order_sql = "score, r.id" if q else "r.id"
+
+    def fetch(cursor, count):
+        keyset_clauses = list(where_clauses)
+        keyset_params = list(params)
+        if cursor is not None:
+            score, last_id = cursor
+            if q:
+                keyset_clauses.append("(score > ? OR (score = ? AND r.id > ?))")
+                keyset_params.extend([score, score, last_id])
+            else:
+                keyset_clauses.append("r.id > ?")
+                keyset_params.append(last_id)
+        keyset_sql = f"WHERE {' AND '.join(keyset_clauses)}" if keyset_clauses else ""
+        rows = run_query(
+            f"""
+            SELECT {columns}, {score_sql} AS score, r.id
+            FROM {from_sql}
+            JOIN categories c ON c.id = r.category_id
+            {joins}
+            {keyset_sql}
+            ORDER BY {order_sql}
+            LIMIT ?
+            """,
+            keyset_params + [count + 1]
+        )
+        has_more = len(rows) > count
+        rows = rows[:count]
+        # Without new rows the cursor stays where it was, so it can be stored and reused
+        last_key = (rows[-1][-2], rows[-1][-1]) if rows else cursor
+        return [to_item(row[:-2]) for row in rows], last_key, has_more
+
+    if not ndjson:
+        limit = max(1, min(limit or API_PAGE_SIZE, API_MAX_PAGE_SIZE))
+        items, last_key, has_more = fetch(after, limit)
+        return json_response(json.dumps({"items": items,
+                                         "next_cursor": encode_cursor(*last_key) if last_key else None,
+                                         "has_more": has_more}, separators=(",", ":")))
+
+    def generate():
+        last_key, remaining = after, (max(1, limit) if limit is not None else None)
+        has_more = True
+        while has_more and remaining != 0:
+            count = API_STREAM_CHUNK if remaining is None else min(API_STREAM_CHUNK, remaining)
+            items, last_key, has_more = fetch(last_key, count)
+            for item in items:
+                yield json.dumps(item, separators=(",", ":")) + "\n"
+            if remaining is not None:
+                remaining -= len(items)
+        yield json.dumps({"next_cursor": encode_cursor(*last_key) if last_key else None,
+                          "has_more": has_more}, separators=(",", ":")) + "\n"
+
+    # Not wrapped in stream_with_context: outside the request each chunk's query borrows a
+    # pooled connection and hands it back before its rows are sent, instead of the stream
+    # holding the request's connection until a slow client has read everything
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+@app.route("/api/recipes/<int:recipe_id>", methods=["GET"])
+def api_recipe(recipe_id: int):
+    require_login()
+    fields = api_fields(tuple(API_FIELDS))
+    columns, joins, to_item = api_projection(fields)
+    rows = run_query(
+        f"""
+        SELECT {columns}
+        FROM recipes r
+        JOIN categories c ON c.id = r.category_id
+        {joins}
+        WHERE r.id = ?
+        """,
+        [recipe_id]
+    )
+    if not rows:
+        abort(404)
+    return json_response(json.dumps(to_item(rows[0]), separators=(",", ":")))
@@ -0,0 +1,114 @@
+"""
+ASGI entry point for serving many concurrent slow clients, e.g.
+
+    pip install asgiref uvicorn
+    uvicorn asgi:application
+
+Cover images are served natively here: database work runs on the bounded executor in
+helpers and the BLOB is streamed chunk by chunk without holding a thread per client.
+Every other route is handed to the Flask app through asgiref's WSGI adapter. The
+whole request body is read on the event loop first, so slow uploads do not tie up a
+worker thread either. Flask then runs on a pool of ASGI_WSGI_THREADS threads (by
+default one per pooled database connection); asgiref alone would run every request
+on one shared thread.
+"""
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.wsgi import WsgiToAsgi
+from itsdangerous import BadSignature
+from werkzeug.http import parse_cookie
+
+from app import app
+from helpers import POOL_SIZE, run_in_db, stream_blob_async
+from images import plan_cover_response
+
+COVER_PATH = re.compile(r"/recipes/(\d+)/cover")
+# Threads running Flask requests; each request holds a pooled connection until it ends
+ASGI_WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", str(POOL_SIZE)))
+
+wsgi_executor = ThreadPoolExecutor(max_workers=ASGI_WSGI_THREADS, thread_name_prefix="wsgi")
+wsgi_application = WsgiToAsgi(app)
+
+
+def _run_flask(scope, receive, send):
+    # WsgiToAsgi runs Flask as thread-sensitive code, which asgiref places on the thread
+    # of the enclosing async_to_sync: this wsgi_executor thread
+    async_to_sync(wsgi_application)(scope, receive, send)
+
+
+async def flask_application(scope, receive, send):
+    """Reads the request body, then runs the request on wsgi_executor."""
+    if scope["type"] != "http":
+        raise ValueError("WSGI wrapper received a non-HTTP scope")
+    body = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            return  # The client went away before sending the whole body
+        body.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+
+    async def replay():
+        return {"type": "http.request", "body": b"".join(body), "more_body": False}
+
+    await sync_to_async(_run_flask, thread_sensitive=False, executor=wsgi_executor)(scope, replay, send)
+
+
+def _session_user_id(headers):
+    """Reads the user id from Flask's signed session cookie, or None if not signed in."""
+    cookies = parse_cookie(headers.get(b"cookie", b"").decode("latin-1"))
+    token = cookies.get(app.config["SESSION_COOKIE_NAME"])
+    if not token:
+        return None
+    serializer = app.session_interface.get_signing_serializer(app)
+    try:
+        data = serializer.loads(token, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return data.get("user_id")
+
+
+async def _send_empty(send, status, headers=None):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def serve_cover(scope, send, recipe_id):
+    headers = dict(scope["headers"])
+    if _session_user_id(headers) is None:
+        await _send_empty(send, 403)
+        return
+
+    size = parse_qs(scope["query_string"].decode("latin-1")).get("size", ["original"])[0]
+    if_none_match = headers.get(b"if-none-match", b"").decode("latin-1") or None
+    range_header = headers.get(b"range", b"").decode("latin-1") or None
+    plan = await run_in_db(plan_cover_response, recipe_id, size, if_none_match, range_header)
+    if plan is None:
+        await _send_empty(send, 404)
+        return
+
+    status, response_headers, body = plan
+    if body is None or scope["method"] == "HEAD":
+        await _send_empty(send, status, response_headers)
+        return
+
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(k.lower().encode(), v.encode()) for k, v in response_headers.items()]})
+    async for chunk in stream_blob_async(*body):
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "http" and scope["method"] in ("GET", "HEAD"):
+        match = COVER_PATH.fullmatch(scope["path"])
+        if match:
+            await serve_cover(scope, send, int(match.group(1)))
+            return
+    await flask_application(scope, receive, send)
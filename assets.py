@@ -0,0 +1,123 @@
+"""
+Fingerprinted static assets. A build step copies every file under static/ to static/dist/
+with a content hash in its name, writes gzip (and brotli, if installed) variants next to
+it and records the mapping in static/dist/manifest.json:
+
+    flask build-assets
+
+Templates link assets through asset_url('css/base.css'), which resolves to the hashed
+/assets/... URL when the manifest has the file and to the plain /static/... URL otherwise,
+so the app works without a build. Hashed files never change, so they are served with a
+one year immutable Cache-Control and picked precompressed by Accept-Encoding. The manifest
+is read at startup: restart the app after rebuilding.
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+import click
+from flask import abort, current_app, send_file, url_for
+from werkzeug.security import safe_join
+
+from compression import COMPRESS_MIMETYPES, available_encodings, compress, negotiate_encoding
+
+DIST_DIR = "dist"
+MANIFEST_NAME = "manifest.json"
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+FINGERPRINT_LENGTH = 12
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+BUILD_LEVELS = {"br": 11, "gzip": 9}
+
+
+def dist_path(app):
+    return os.path.join(app.static_folder, DIST_DIR)
+
+
+def load_manifest(app):
+    try:
+        with open(os.path.join(dist_path(app), MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def asset_url(filename: str) -> str:
+    """URL of a static file, the fingerprinted copy when one has been built."""
+    hashed = current_app.extensions["asset_manifest"].get(filename)
+    if hashed is None:
+        return url_for("static", filename=filename)
+    return url_for("asset", filename=hashed)
+
+
+def fingerprinted_name(relpath, data):
+    root, ext = os.path.splitext(relpath)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:FINGERPRINT_LENGTH]}{ext}".replace(os.sep, "/")
+
+
+def build_assets(app):
+    """
+    Rebuilds static/dist from scratch and returns the new manifest.
+    Compressed variants are only kept when they are smaller than the original.
+    """
+    source, target = app.static_folder, dist_path(app)
+    shutil.rmtree(target, ignore_errors=True)
+    manifest = {}
+    for directory, subdirs, files in os.walk(source):
+        if os.path.abspath(directory) == os.path.abspath(source):
+            subdirs[:] = [d for d in subdirs if d != DIST_DIR]
+        for name in sorted(files):
+            path = os.path.join(directory, name)
+            relpath = os.path.relpath(path, source)
+            with open(path, "rb") as f:
+                data = f.read()
+            hashed = fingerprinted_name(relpath, data)
+            out = os.path.join(target, hashed)
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            with open(out, "wb") as f:
+                f.write(data)
+            if mimetypes.guess_type(name)[0] in COMPRESS_MIMETYPES:
+                for encoding in available_encodings():
+                    compressed = compress(data, encoding, BUILD_LEVELS[encoding])
+                    if len(compressed) < len(data):
+                        with open(out + ENCODING_SUFFIXES[encoding], "wb") as f:
+                            f.write(compressed)
+            manifest[relpath.replace(os.sep, "/")] = hashed
+    with open(os.path.join(target, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def serve_asset(filename):
+    path = safe_join(dist_path(current_app), filename)
+    if path is None or filename == MANIFEST_NAME or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    offered = [e for e in ENCODING_SUFFIXES if os.path.isfile(path + ENCODING_SUFFIXES[e])]
+    encoding = negotiate_encoding(offered) if offered else None
+    resp = send_file(path + ENCODING_SUFFIXES[encoding] if encoding else path, mimetype=mimetype,
+                     max_age=ASSET_MAX_AGE, conditional=True)
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    if offered:
+        resp.vary.add("Accept-Encoding")
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
+
+@click.command("build-assets")
+def build_assets_command():
+    """Fingerprint and precompress the files under static/ into static/dist/."""
+    manifest = build_assets(current_app)
+    current_app.extensions["asset_manifest"] = manifest
+    encodings = ", ".join(available_encodings())
+    click.echo(f"Built {len(manifest)} asset(s) in {dist_path(current_app)} ({encodings})")
+
+
+def init_app(app):
+    app.extensions["asset_manifest"] = load_manifest(app)
+    app.jinja_env.globals["asset_url"] = asset_url
+    app.add_url_rule("/assets/<path:filename>", "asset", serve_asset)
+    app.cli.add_command(build_assets_command)
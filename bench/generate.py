@@ -0,0 +1,177 @@
+"""
+Builds a synthetic database of configurable size that matches schema.sql, for finding
+the scaling problems that the small mock-data.sql seed hides.
+
+Ratings and comments are skewed (Zipf-like) so a few recipes get most of the
+engagement, like on a real site. Every generated user has the password "password".
+
+Usage:
+    python bench/generate.py --db bench/bench.db --recipes 100000
+    python bench/generate.py --db bench/bench.db --recipes 1000000 --images 0.05
+"""
+import argparse
+import hashlib
+import itertools
+import os
+import random
+import sqlite3
+import struct
+import sys
+import time
+import zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ADJECTIVES = ["Classic", "Spicy", "Creamy", "Crispy", "Smoky", "Zesty", "Rustic", "Golden", "Herbed", "Sweet",
+              "Savory", "Tangy", "Garlicky", "Roasted", "Grilled", "Quick", "Hearty", "Light", "Fluffy", "Rich"]
+DISHES = ["Pancakes", "Curry", "Salad", "Soup", "Stew", "Tacos", "Pasta", "Risotto", "Burger", "Omelette",
+          "Casserole", "Stir Fry", "Pie", "Brownies", "Cookies", "Noodles", "Chili", "Flatbread", "Bowl", "Skewers"]
+INGREDIENTS = ["Flour", "Milk", "Eggs", "Sugar", "Salt", "Butter", "Olive oil", "Garlic", "Onion", "Tomato",
+               "Chicken breast", "Beef", "Tofu", "Rice", "Lentils", "Chickpeas", "Spinach", "Carrot", "Potato",
+               "Lemon", "Lime", "Basil", "Cilantro", "Cumin", "Paprika", "Chili flakes", "Ginger", "Soy sauce",
+               "Honey", "Yogurt", "Cheese", "Cream", "Mushrooms", "Bell pepper", "Zucchini", "Avocado", "Black beans"]
+STEPS = ["Preheat the oven", "Chop the vegetables", "Whisk the dry ingredients", "Sear until golden",
+         "Simmer for twenty minutes", "Season to taste", "Fold in gently", "Bake until set", "Rest before serving",
+         "Toss with the dressing", "Stir occasionally", "Reduce the sauce", "Garnish and serve"]
+COMMENTS = ["Loved it!", "Made this twice already.", "Needed more salt for us.", "Great weeknight dinner.",
+            "Kids asked for seconds.", "Swapped the butter for oil, still great.", "Too spicy for me.",
+            "Easy and tasty.", "Will make again.", "Took longer than expected but worth it."]
+
+
+def zipf_weights(n, s):
+    return [1.0 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def tiny_png(width, height, rgb):
+    """Encodes a solid-colour PNG without any imaging library."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+    row = b"\x00" + bytes(rgb) * width
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * height, 9))
+            + chunk(b"IEND", b""))
+
+
+def batched(iterable, size):
+    it = iter(iterable)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def insert_batches(db, sql, rows, batch_size, label):
+    started = time.perf_counter()
+    count = 0
+    for batch in batched(rows, batch_size):
+        with db:
+            db.executemany(sql, batch)
+        count += len(batch)
+        print(f"\r  {label}: {count}", end="", file=sys.stderr)
+    print(f"\r  {label}: {count} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+def generate(args):
+    rng = random.Random(args.seed)
+    if os.path.exists(args.db):
+        if not args.force:
+            sys.exit(f"{args.db} already exists, pass --force to overwrite it")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+
+    db = sqlite3.connect(args.db)
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute("PRAGMA foreign_keys = ON")
+    for script in ("schema.sql", "init.sql"):
+        with open(os.path.join(ROOT, script), encoding="utf-8") as f:
+            db.executescript(f.read())
+
+    category_ids = [row[0] for row in db.execute("SELECT id FROM categories")]
+
+    insert_batches(db, "INSERT INTO users (id, username, password) VALUES (?, ?, ?)",
+                   ((i, f"user{i}", "password") for i in range(1, args.users + 1)), args.batch_size, "users")
+
+    def recipes():
+        for i in range(1, args.recipes + 1):
+            ingredients = rng.sample(INGREDIENTS, rng.randint(3, 12))
+            directions = rng.choices(STEPS, k=rng.randint(3, args.max_steps))
+            yield (i,
+                   f"{rng.choice(ADJECTIVES)} {rng.choice(ADJECTIVES)} {rng.choice(DISHES)} {i}",
+                   "; ".join(ingredients),
+                   ". ".join(directions) + ".",
+                   rng.randint(1, args.users),
+                   rng.choice(category_ids))
+
+    insert_batches(db, "INSERT INTO recipes (id, name, ingredients, directions, user_id, category_id) "
+                       "VALUES (?, ?, ?, ?, ?, ?)", recipes(), args.batch_size, "recipes")
+
+    # Popularity is shuffled so the hottest recipes are spread over the id range
+    popularity = list(range(1, args.recipes + 1))
+    rng.shuffle(popularity)
+    weights = list(itertools.accumulate(zipf_weights(args.recipes, args.skew)))
+
+    def ratings():
+        seen = set()
+        for _ in range(int(args.recipes * args.ratings_per_recipe)):
+            recipe_id = rng.choices(popularity, cum_weights=weights)[0]
+            user_id = rng.randint(1, args.users)
+            if (recipe_id, user_id) in seen:
+                continue
+            seen.add((recipe_id, user_id))
+            yield rng.choices((1, 2, 3, 4, 5), weights=(1, 1, 3, 6, 5))[0], recipe_id, user_id
+
+    insert_batches(db, "INSERT INTO ratings (rating, recipe_id, user_id) VALUES (?, ?, ?)",
+                   ratings(), args.batch_size, "ratings")
+
+    now = int(time.time())
+
+    def comments():
+        for _ in range(int(args.recipes * args.comments_per_recipe)):
+            yield (rng.choice(COMMENTS),
+                   rng.choices(popularity, cum_weights=weights)[0],
+                   rng.randint(1, args.users),
+                   now - rng.randint(0, 365 * 24 * 3600))
+
+    insert_batches(db, "INSERT INTO comments (content, recipe_id, user_id, created_at) VALUES (?, ?, ?, ?)",
+                   comments(), args.batch_size, "comments")
+
+    if args.images:
+        def images():
+            for recipe_id in rng.sample(range(1, args.recipes + 1), int(args.recipes * args.images)):
+                data = tiny_png(args.image_size, args.image_size,
+                                (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+                yield recipe_id, data, "image/png", hashlib.sha256(data).hexdigest()
+
+        insert_batches(db, "INSERT INTO recipe_images (recipe_id, image, mime_type, content_hash) VALUES (?, ?, ?, ?)",
+                       images(), args.batch_size, "images")
+
+    db.execute("ANALYZE")
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=os.path.join(ROOT, "bench", "bench.db"), help="Output database file")
+    parser.add_argument("--force", action="store_true", help="Overwrite an existing database")
+    parser.add_argument("--recipes", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=None, help="Defaults to recipes / 10")
+    parser.add_argument("--ratings-per-recipe", type=float, default=5.0, help="Average, skewed by --skew")
+    parser.add_argument("--comments-per-recipe", type=float, default=3.0, help="Average, skewed by --skew")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent for engagement per recipe")
+    parser.add_argument("--max-steps", type=int, default=20, help="Upper bound of direction steps per recipe")
+    parser.add_argument("--images", type=float, default=0.0, help="Fraction of recipes that get a cover image")
+    parser.add_argument("--image-size", type=int, default=256, help="Edge length of generated covers in pixels")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if args.users is None:
+        args.users = max(10, args.recipes // 10)
+    generate(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+Route-level load benchmark. Drives the app's routes through the Flask test client
+against a database (usually one built with bench/generate.py) and reports p50/p95/p99
+latency, throughput and SQL statements per request for each route.
+
+Read routes (pages, JSON API, NDJSON export, covers, /metrics) always run. --writes adds
+the form posts (login, signup, create, edit, rate, comment); they run against a scratch
+copy of the database, which is deleted afterwards. /logout, /recipes/delete and
+/comment/delete are never driven: they would sign the bench client out or delete the
+rows the other routes read.
+
+Results are written as JSON to bench/results/ so runs can be compared:
+
+    python bench/run.py --db bench/bench.db --label baseline
+    python bench/run.py --db bench/bench.db --label fts --compare bench/results/<baseline>.json
+    python bench/run.py --db bench/bench.db --label writes --writes --routes rate,comment
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Run signed out, with a fresh client per request; a signed-in client is just redirected
+ANONYMOUS_ROUTES = {"login_page", "login", "create_account"}
+
+
+class StatementCounter:
+    """
+    Counts SQL statements issued on every connection the app opens (trigger bodies
+    excluded), per thread. Writes run on the writer thread, so a route's count only
+    covers the statements its request thread runs.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def trace(self, statement):
+        if not statement.startswith("--"):
+            self.local.count = getattr(self.local, "count", 0) + 1
+
+    def take(self):
+        count = getattr(self.local, "count", 0)
+        self.local.count = 0
+        return count
+
+
+def load_app(db_path, counter):
+    os.environ["DATABASE_PATH"] = os.path.abspath(db_path)
+    sys.path.insert(0, ROOT)
+    import helpers  # pylint: disable=import-outside-toplevel
+
+    open_connection = helpers.open_connection
+
+    def traced_open_connection(*args, **kwargs):
+        db = open_connection(*args, **kwargs)
+        db.set_trace_callback(counter.trace)
+        return db
+
+    helpers.open_connection = traced_open_connection
+    from app import app  # pylint: disable=import-outside-toplevel
+    return app
+
+
+def scratch_copy(db_path):
+    """Copies the database (WAL included) into a temp directory for the write routes."""
+    directory = tempfile.mkdtemp(prefix="bench-")
+    path = os.path.join(directory, os.path.basename(db_path))
+    source, target = sqlite3.connect(db_path), sqlite3.connect(path)
+    source.backup(target)
+    source.close()
+    target.close()
+    return path
+
+
+def pick_routes(db_path, rng, writes=False):
+    """
+    Returns route name -> callable giving the next request, and the bench user. A
+    request is a path to GET or a (method, path, form data) tuple.
+    """
+    db = sqlite3.connect(db_path)
+    max_id = db.execute("SELECT MAX(id) FROM recipes").fetchone()[0] or 1
+    hot_id = db.execute("SELECT recipe_id FROM recipe_stats ORDER BY comment_count DESC LIMIT 1").fetchone()
+    hot_id = hot_id[0] if hot_id else 1
+    category_id = db.execute("SELECT category_id FROM recipes GROUP BY category_id "
+                             "ORDER BY COUNT(*) DESC LIMIT 1").fetchone()
+    image_id = db.execute("SELECT recipe_id FROM recipe_images LIMIT 1").fetchone()
+    user = db.execute("SELECT id, username, password FROM users WHERE id = (SELECT user_id FROM recipes "
+                      "GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1)").fetchone()
+    own_ids = [row[0] for row in db.execute("SELECT id FROM recipes WHERE user_id = ? LIMIT 50", [user[0]])]
+    other_ids = [row[0] for row in db.execute("SELECT id FROM recipes WHERE user_id IS NOT ? LIMIT 50", [user[0]])]
+    db.close()
+
+    random_ids = [rng.randint(1, max_id) for _ in range(50)]
+    routes = {
+        "index": lambda: "/",
+        "recipes": lambda: "/recipes",
+        "recipes_search": lambda: f"/recipes?q={rng.choice(['curry', 'garlic', 'crispy soup', 'lemon', 'tofu'])}",
+        "recipes_category": lambda: f"/recipes?cat={category_id[0] if category_id else 1}",
+        "recipes_last_page": lambda: "/recipes?last=1",
+        "recipe_hot": lambda: f"/recipes/{hot_id}",
+        "recipe_random": lambda: f"/recipes/{rng.choice(random_ids)}",
+        "recipe_comments": lambda: f"/recipes/{hot_id}/comments",
+        "account": lambda: "/account",
+        "login_page": lambda: "/login",
+        "api_recipes": lambda: "/api/recipes",
+        "api_recipes_search": lambda: f"/api/recipes?q={rng.choice(['curry', 'garlic', 'lemon', 'tofu'])}",
+        "api_recipes_ndjson": lambda: "/api/recipes?format=ndjson&limit=500",
+        "api_recipe": lambda: f"/api/recipes/{rng.choice(random_ids)}",
+        "metrics": lambda: "/metrics",
+    }
+    if image_id:
+        routes["cover"] = lambda: f"/recipes/{image_id[0]}/cover"
+    if own_ids:
+        routes["recipe_edit_page"] = lambda: f"/recipes/{rng.choice(own_ids)}/edit"
+    if not writes:
+        return routes, user[1:]
+
+    serial = itertools.count()
+    category = category_id[0] if category_id else 1
+
+    def recipe_form():
+        n = next(serial)
+        return {"name": f"Bench recipe {n}", "category_id": category,
+                "ingredients": f"{n} cups of flour, water and salt",
+                "directions": f"Mix, knead and bake for {n % 60} minutes"}
+
+    routes["login"] = lambda: ("POST", "/login", {"username": user[1], "password": user[2]})
+    routes["create_account"] = lambda: ("POST", "/create_account",
+                                        {"username": f"bench{next(serial)}", "password": "bench-password"})
+    routes["create_recipe"] = lambda: ("POST", "/create_recipe", recipe_form())
+    if own_ids:
+        routes["recipe_edit"] = lambda: ("POST", f"/recipes/{rng.choice(own_ids)}/edit", recipe_form())
+    if other_ids:
+        routes["rate"] = lambda: ("POST", "/rate", {"recipe_id": rng.choice(other_ids), "rating": rng.randint(1, 5)})
+    routes["comment"] = lambda: ("POST", "/comment", {"recipe_id": rng.choice(random_ids),
+                                                      "content": f"Bench comment {next(serial)}"})
+    return routes, user[1:]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def bench_route(app, counter, user, make_request, requests, concurrency, warmup):
+    local = threading.local()
+
+    def client():
+        if user is None:
+            return app.test_client()
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+            local.client.post("/login", data={"username": user[0], "password": user[1]})
+        return local.client
+
+    def one():
+        c = client()
+        req = make_request()
+        counter.take()
+        started = time.perf_counter()
+        if isinstance(req, str):
+            resp = c.get(req)
+        else:
+            method, path, data = req
+            resp = c.open(path, method=method, data=data)
+        _ = resp.data
+        elapsed = time.perf_counter() - started
+        return elapsed, counter.take(), resp.status_code
+
+    for _ in range(warmup):
+        one()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(lambda _: one(), range(requests)))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(s[0] * 1000 for s in samples)
+    return {
+        "requests": requests,
+        "errors": sum(1 for s in samples if s[2] >= 400),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": statistics.fmean(latencies),
+        "rps": requests / wall if wall else 0.0,
+        "queries_per_request": statistics.fmean(s[1] for s in samples),
+    }
+
+
+def dataset_info(db_path):
+    db = sqlite3.connect(db_path)
+    info = {table: db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("users", "recipes", "ratings", "comments", "recipe_images")}
+    db.close()
+    return info
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, baseline=None):
+    header = f"{'route':<20}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'queries':>9}"
+    if baseline:
+        header += f"{'p95 delta':>12}"
+    print(header)
+    for route, r in results.items():
+        line = (f"{route:<20}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+                f"{r['rps']:>10.1f}{r['queries_per_request']:>9.1f}")
+        old = (baseline or {}).get(route)
+        if old and old["p95_ms"]:
+            line += f"{(r['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100:>+11.1f}%"
+        if r["errors"]:
+            line += f"  ({r['errors']} errors)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=os.path.join(ROOT, "bench", "bench.db"))
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per route")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests per route")
+    parser.add_argument("--concurrency", type=int, default=1, help="Client threads per route")
+    parser.add_argument("--routes", help="Comma separated subset of routes to run")
+    parser.add_argument("--writes", action="store_true",
+                        help="Also run the form posts, against a scratch copy of --db")
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--output-dir", default=os.path.join(ROOT, "bench", "results"))
+    parser.add_argument("--compare", help="Earlier results JSON to compare p95 latency against")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        sys.exit(f"{args.db} does not exist, create it with bench/generate.py")
+
+    db_path = scratch_copy(args.db) if args.writes else args.db
+    try:
+        counter = StatementCounter()
+        app = load_app(db_path, counter)
+        routes, user = pick_routes(db_path, random.Random(args.seed), args.writes)
+        if args.routes:
+            wanted = set(args.routes.split(","))
+            routes = {name: make_request for name, make_request in routes.items() if name in wanted}
+
+        results = {}
+        for name, make_request in routes.items():
+            results[name] = bench_route(app, counter, None if name in ANONYMOUS_ROUTES else user, make_request,
+                                        args.requests, args.concurrency, args.warmup)
+    finally:
+        if args.writes:
+            shutil.rmtree(os.path.dirname(db_path), ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["routes"]
+    print_report(results, baseline)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    label = re.sub(r"[^\w.-]", "_", args.label)
+    path = os.path.join(args.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{label}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "label": args.label,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "settings": {"requests": args.requests, "warmup": args.warmup, "concurrency": args.concurrency,
+                         "writes": args.writes},
+            "dataset": dataset_info(args.db),
+            "routes": results,
+        }, f, indent=2)
+    print(f"Saved {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""
+Bulk import and export of the recipe catalog, for migrations and restores:
+
+    flask import-data recipes backup/recipes.jsonl
+    flask import-data ratings ratings.csv --batch-size 20000
+    flask export-data backup/ --images
+
+Records are streamed from and to disk, so neither command holds a whole table in
+memory. Users are not part of the catalog and must already exist.
+"""
+import base64
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import click
+
+from helpers import (categories_cache, create_connection, close_connection, rebuild_stats, rebuild_summaries,
+                     run_write, sniff_image_type)
+
+# Columns read and written per kind; "id" is optional on import and assigned by SQLite when missing
+CATALOG = {
+    "categories": ("id", "name"),
+    "recipes": ("id", "name", "ingredients", "directions", "user_id", "category_id"),
+    "ratings": ("id", "rating", "recipe_id", "user_id"),
+    "comments": ("id", "content", "recipe_id", "user_id", "created_at"),
+}
+OPTIONAL_COLUMNS = {"id", "created_at"}
+IMPORT_BATCH_SIZE = 5000
+# Definitions of the indexes and triggers an import has dropped, until it restores them
+DEFERRED_TABLE = "bulk_deferred_maintenance"
+# Indexes app.py names in INDEXED BY hints; queries using them fail while they are missing, so they stay
+KEPT_INDEXES = ("idx_recipes_list",)
+EXPORT_FETCH_SIZE = 1000
+
+
+def read_records(path, fmt):
+    """
+    Yields (line number, record dict) from a JSONL or CSV file, one record at a time.
+    Empty CSV cells are read as None.
+    """
+    with open(path, encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, {key: value if value != "" else None for key, value in record.items()}
+            return
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except json.JSONDecodeError as exc:
+                raise click.ClickException(f"{path}:{line_no}: invalid JSON ({exc.msg})") from exc
+
+
+def to_row(kind, record, location):
+    row = []
+    for column in CATALOG[kind]:
+        value = record.get(column)
+        if value is None and column not in OPTIONAL_COLUMNS:
+            raise click.ClickException(f"{location}: missing {column}")
+        if value is None and column == "created_at":
+            value = int(time.time())
+        row.append(value)
+    return tuple(row)
+
+
+def to_image(record, location):
+    """Returns (image bytes, mime type, sha256) for a record that carries a base64 cover, else None."""
+    if not record.get("image"):
+        return None
+    try:
+        data = base64.b64decode(record["image"], validate=True)
+    except ValueError as exc:
+        raise click.ClickException(f"{location}: image is not valid base64") from exc
+    mime_type = record.get("image_mime_type") or sniff_image_type(data[:12]) or "application/octet-stream"
+    return data, mime_type, hashlib.sha256(data).hexdigest()
+
+
+def insert_statement(kind):
+    columns = CATALOG[kind]
+    return f"INSERT INTO {kind} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+
+
+def insert_batch(kind, rows, images, location):
+    """
+    Inserts one batch in a single transaction on the writer. Recipes with a cover but
+    no id are inserted one at a time so the image can be attached to the new row.
+    A constraint violation rejects the whole batch, location names its last record.
+    """
+    sql = insert_statement(kind)
+
+    def write(db):
+        plain = [row for row, image in zip(rows, images) if image is None]
+        db.executemany(sql, plain)
+        covers = []
+        for row, image in zip(rows, images):
+            if image is not None:
+                recipe_id = db.execute(sql, row).lastrowid
+                covers.append((recipe_id,) + image)
+        db.executemany("INSERT OR REPLACE INTO recipe_images (recipe_id, image, mime_type, content_hash) "
+                       "VALUES (?, ?, ?, ?)", covers)
+
+    try:
+        run_write(write)
+    except sqlite3.IntegrityError as exc:
+        raise click.ClickException(f"{location}: batch ending here was rejected ({exc})") from exc
+
+
+def deferred_tables(db):
+    """Tables whose maintenance a running or interrupted import has dropped."""
+    db.execute(f"CREATE TABLE IF NOT EXISTS {DEFERRED_TABLE} "
+               "(tbl_name TEXT NOT NULL, type TEXT NOT NULL, name TEXT PRIMARY KEY, sql TEXT NOT NULL)")
+    return [row[0] for row in db.execute(f"SELECT DISTINCT tbl_name FROM {DEFERRED_TABLE}")]
+
+
+def drop_maintenance(table):
+    """
+    Drops the non-unique indexes (except KEPT_INDEXES) and the triggers (FTS sync, summaries, stats) on a
+    table so rows go in without per-row upkeep. Their definitions are saved in DEFERRED_TABLE in the same transaction, so
+    restore_maintenance (or `flask restore-maintenance` after a killed import) can recreate them.
+    """
+    def drop(db):
+        pending = deferred_tables(db)
+        if pending:
+            raise click.ClickException(f"An earlier import left the indexes and triggers of {', '.join(pending)} "
+                                       "dropped, run `flask restore-maintenance` first")
+        objects = db.execute(
+            f"""
+            SELECT tbl_name, type, name, sql FROM sqlite_master
+            WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL
+              AND sql NOT LIKE 'CREATE UNIQUE%' AND name NOT IN ({", ".join("?" for _ in KEPT_INDEXES)})
+            """, [table, *KEPT_INDEXES]).fetchall()
+        db.executemany(f"INSERT INTO {DEFERRED_TABLE} (tbl_name, type, name, sql) VALUES (?, ?, ?, ?)", objects)
+        for _, kind, name, _ in objects:
+            db.execute(f"DROP {kind.upper()} {name}")
+
+    run_write(drop)
+
+
+def restore_maintenance(table):
+    """Recreates what drop_maintenance removed and rebuilds the derived data in one pass."""
+    def restore(db):
+        deferred_tables(db)
+        objects = db.execute(f"SELECT type, sql FROM {DEFERRED_TABLE} WHERE tbl_name = ?", [table]).fetchall()
+        # Indexes first so the rebuild queries below can use them
+        for _, sql in sorted(objects, key=lambda o: o[0] != "index"):
+            db.execute(sql)
+        db.execute(f"DELETE FROM {DEFERRED_TABLE} WHERE tbl_name = ?", [table])
+        if table == "recipes":
+            db.execute("INSERT INTO recipes_fts (recipes_fts) VALUES ('rebuild')")
+            rebuild_summaries(db)
+        rebuild_stats(db)
+
+    run_write(restore)
+
+
+@click.command("import-data")
+@click.argument("kind", type=click.Choice(sorted(CATALOG)))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["jsonl", "csv"]),
+              help="File format, guessed from the file extension by default.")
+@click.option("--batch-size", default=IMPORT_BATCH_SIZE, show_default=True, help="Rows per transaction.")
+@click.option("--defer-indexes/--no-defer-indexes", default=True, show_default=True,
+              help="Drop the table's indexes and triggers during the import and rebuild them (and the "
+                   "search index and statistics) at the end. Use --no-defer-indexes for small imports "
+                   "into a database the app is serving.")
+def import_data_command(kind, path, fmt, batch_size, defer_indexes):
+    """Import categories, recipes, ratings or comments from a JSONL or CSV file."""
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    started = time.perf_counter()
+    if defer_indexes:
+        drop_maintenance(kind)
+    count = 0
+    try:
+        rows, images = [], []
+        for line_no, record in read_records(path, fmt):
+            location = f"{path}:{line_no}"
+            rows.append(to_row(kind, record, location))
+            images.append(to_image(record, location) if kind == "recipes" else None)
+            if len(rows) >= batch_size:
+                insert_batch(kind, rows, images, location)
+                count += len(rows)
+                rows, images = [], []
+                click.echo(f"\r  {kind}: {count}", nl=False, err=True)
+        if rows:
+            insert_batch(kind, rows, images, location)
+            count += len(rows)
+    finally:
+        click.echo(f"\r  {kind}: {count}" + (", rebuilding indexes" if defer_indexes else ""), err=True)
+        if defer_indexes:
+            restore_maintenance(kind)
+        if kind == "categories":
+            # Other processes pick the new categories up when their cache expires
+            categories_cache.invalidate()
+    click.echo(f"Imported {count} {kind} in {time.perf_counter() - started:.1f}s")
+
+
+@click.command("restore-maintenance")
+def restore_maintenance_command():
+    """Recreate the indexes and triggers an interrupted import-data left dropped."""
+    tables = run_write(deferred_tables)
+    for table in tables:
+        click.echo(f"Restoring the indexes and triggers of {table}")
+        restore_maintenance(table)
+    if not tables:
+        click.echo("Nothing to restore")
+
+
+def export_columns(kind, images):
+    return CATALOG[kind] + (("image", "image_mime_type") if images and kind == "recipes" else ())
+
+
+def export_rows(db, kind, images):
+    """Yields the records of one table in id order, fetching EXPORT_FETCH_SIZE rows at a time."""
+    columns = ", ".join(f"t.{column}" for column in CATALOG[kind])
+    if images and kind == "recipes":
+        cursor = db.execute(f"SELECT {columns}, i.image, i.mime_type FROM recipes t "
+                            "LEFT JOIN recipe_images i ON i.recipe_id = t.id ORDER BY t.id")
+    else:
+        cursor = db.execute(f"SELECT {columns} FROM {kind} t ORDER BY t.id")
+    names = export_columns(kind, images)
+    while batch := cursor.fetchmany(EXPORT_FETCH_SIZE):
+        for row in batch:
+            record = dict(zip(names, row))
+            if record.get("image") is not None:
+                record["image"] = base64.b64encode(record["image"]).decode("ascii")
+            yield record
+
+
+@click.command("export-data")
+@click.argument("directory", type=click.Path(file_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["jsonl", "csv"]), default="jsonl", show_default=True)
+@click.option("--images", is_flag=True, help="Include recipe covers as base64.")
+def export_data_command(directory, fmt, images):
+    """Export categories, recipes, ratings and comments to one file per table, ready for import-data."""
+    os.makedirs(directory, exist_ok=True)
+    db = create_connection()
+    try:
+        # One read transaction so every exported file comes from the same snapshot
+        db.execute("BEGIN")
+        for kind in CATALOG:
+            path = os.path.join(directory, f"{kind}.{fmt}")
+            count = 0
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                if fmt == "csv":
+                    writer = csv.DictWriter(f, fieldnames=export_columns(kind, images))
+                    writer.writeheader()
+                    write = writer.writerow
+                else:
+                    def write(record, f=f):
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                for record in export_rows(db, kind, images):
+                    write(record)
+                    count += 1
+            click.echo(f"Exported {count} {kind} to {path}")
+    finally:
+        if db.in_transaction:
+            db.execute("ROLLBACK")
+        close_connection(db)
+
+
+def init_app(app):
+    app.cli.add_command(import_data_command)
+    app.cli.add_command(export_data_command)
+    app.cli.add_command(restore_maintenance_command)
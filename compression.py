@@ -0,0 +1,70 @@
+"""
+Response compression. HTML, JSON and other text responses above COMPRESS_MIN_SIZE are
+compressed with brotli when the client accepts it and the brotli package is installed
+(pip install brotli), and with gzip otherwise. Streamed responses (NDJSON exports, cover
+images, send_file) are passed through untouched, as are responses that already carry a
+Content-Encoding, e.g. the precompressed assets served by assets.py.
+"""
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+# Below this many bytes the saving does not pay for the extra CPU and header
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_MIMETYPES = {"text/html", "text/plain", "text/css", "text/javascript", "application/javascript",
+                      "application/json", "image/svg+xml"}
+# Cheap levels for per-request compression; build-assets uses the maximum levels
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def available_encodings():
+    """Content codings this process can produce, most preferred first."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate_encoding(offered=None):
+    """
+    Picks the coding to use for the current request from the client's Accept-Encoding.
+
+    :param offered: Codings to choose from, most preferred first. Defaults to available_encodings().
+    :return: "br", "gzip" or None to send the response as is.
+    """
+    return request.accept_encodings.best_match(offered or available_encodings())
+
+
+def compress(data: bytes, encoding: str, level=None) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY if level is None else level)
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(data, compresslevel=GZIP_LEVEL if level is None else level, mtime=0)
+
+
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    # The compressed bytes are a different representation, so a strong validator no longer
+    # holds; views compare If-None-Match weakly
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
@@ -1,46 +1,802 @@
+import asyncio
+import atexit
+import base64
+import binascii
+import functools
 import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
 
-def create_connection():
-    db = sqlite3.connect("./database.db")
-    db.execute("PRAGMA foreign_keys = ON")
+import click
+from flask import abort, current_app, g, has_app_context, request
+
+import metrics
+
+DATABASE_PATH = os.environ.get("DATABASE_PATH", "./database.db")
+POOL_SIZE = 8
+# How long a caller waits for a free pooled connection before giving up (503 inside a request)
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+STATEMENT_CACHE_SIZE = 256
+# Threads running blocking database calls for async callers; matches the pool so they never wait on it
+DB_EXECUTOR_WORKERS = POOL_SIZE
+# How long a connection waits on another process holding the database lock
+BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+# How long a caller waits for its write to be committed before giving up (503 inside a request)
+WRITE_TIMEOUT = float(os.environ.get("DB_WRITE_TIMEOUT", "30"))
+# The writer commits up to this many queued writes together, optionally waiting this long for more
+GROUP_COMMIT_MAX = 64
+GROUP_COMMIT_WINDOW = float(os.environ.get("DB_GROUP_COMMIT_WINDOW", "0"))
+# Statements slower than this are logged with their normalized SQL
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+# Opt-in EXPLAIN QUERY PLAN auditing of every distinct statement shape the app runs
+QUERY_PLAN_AUDIT = os.environ.get("QUERY_PLAN_AUDIT") == "1"
+QUERY_PLAN_AUDIT_FILE = os.environ.get("QUERY_PLAN_AUDIT_FILE", "./query-plans.json")
+# Full scans of tables with fewer rows than this are not flagged
+AUDIT_LARGE_TABLE_ROWS = 1000
+# Password checks run on their own small pool so a burst of logins cannot take every request
+# thread's CPU; once this many are waiting, further logins are turned away with 503
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", "2"))
+MAX_PENDING_PASSWORD_CHECKS = 32
+WRITE_BUFFER_MAX_PENDING = 10000
+WRITE_BUFFER_FLUSH_SIZE = 200
+WRITE_BUFFER_FLUSH_INTERVAL = 2.0
+BLOB_CHUNK_SIZE = 64 * 1024
+REFERENCE_CACHE_TTL = 300
+RECIPE_CACHE_TTL = 60
+RECIPE_CACHE_MAX_ENTRIES = 512
+
+logger = logging.getLogger("recipes.sql")
+
+CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+    "PRAGMA temp_store = MEMORY",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+)
+
+
+def open_connection(path, read_only=False):
+    db = sqlite3.connect(path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in CONNECTION_PRAGMAS:
+        db.execute(pragma)
+    if read_only:
+        db.execute("PRAGMA query_only = ON")
     return db
 
+
+class PoolTimeout(RuntimeError):
+    """No pooled connection became free within the pool's timeout."""
+
+
+class WriteTimeout(RuntimeError):
+    """A queued write was not committed within the writer's timeout."""
+
+
+class ConnectionPool:
+    """
+    Keeps a bounded set of long-lived, read-only SQLite connections so that requests
+    do not pay for opening the database file and running the pragmas on every query.
+    Connections are handed out one thread at a time and returned after use. All
+    writes go through the DatabaseWriter instead.
+    """
+
+    def __init__(self, path, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._all = []
+        self._lock = threading.Lock()
+
+    def _open(self):
+        return open_connection(self.path, read_only=True)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._all) < self.size:
+                db = self._open()
+                self._all.append(db)
+                return db
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(f"no database connection became free within {self.timeout}s "
+                              f"(all {self.size} are in use)") from None
+
+    def release(self, db):
+        if db.in_transaction:
+            db.rollback()
+        db.row_factory = None
+        self._idle.put(db)
+
+    def close_all(self):
+        with self._lock:
+            for db in self._all:
+                db.close()
+            self._all.clear()
+            self._idle = queue.LifoQueue(maxsize=self.size)
+
+
+WriteResult = namedtuple("WriteResult", ["lastrowid", "rowcount"])
+
+
+class DatabaseWriter:
+    """
+    Owns the process's only writable connection. Writes are queued as callables and
+    run one after another on a dedicated thread, so concurrent requests never race
+    each other for SQLite's write lock.
+
+    The thread takes up to GROUP_COMMIT_MAX queued writes (waiting up to
+    GROUP_COMMIT_WINDOW seconds for more when configured) and runs them inside one
+    transaction, each under its own savepoint, with a single commit. A write that
+    raises is rolled back alone and its exception is re-raised in the caller.
+
+    If the thread dies, every write still queued fails and the next submit starts a
+    new thread.
+    """
+
+    def __init__(self, path, timeout=WRITE_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._db = None
+        self.jobs = 0
+        self.failed = 0
+        self.commits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, func):
+        """
+        Runs func(db) on the writer connection and waits for it to be committed.
+
+        :param func: Callable taking the writer connection; its return value is returned.
+        :return: Whatever func returned.
+        :raises WriteTimeout: When the write was not committed within the timeout. A
+            write that had not started yet by then is dropped.
+        """
+        future = Future()
+        # Queued under the lock, so a dying writer thread either fails the job or the
+        # job starts the next thread
+        with self._lock:
+            self._queue.put((func, future, time.perf_counter()))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise WriteTimeout(f"write not committed within {self.timeout}s "
+                               f"({self._queue.qsize()} queued)") from None
+
+    def _run(self):
+        try:
+            self._db = open_connection(self.path)
+            self._db.isolation_level = None
+            self._loop()
+        except Exception:  # Logged; the pending writes are failed below
+            logger.exception("Database writer thread died")
+        finally:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+            with self._lock:
+                self._fail_pending(RuntimeError("database writer stopped"))
+                self._thread = None
+
+    def _fail_pending(self, exc):
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if job is not None and job[1].set_running_or_notify_cancel():
+                self.failed += 1
+                job[1].set_exception(exc)
+
+    def _loop(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            batch = [job]
+            deadline = time.monotonic() + GROUP_COMMIT_WINDOW
+            while len(batch) < GROUP_COMMIT_MAX:
+                try:
+                    timeout = deadline - time.monotonic()
+                    job = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    self._queue.put(None)
+                    break
+                batch.append(job)
+            # Writes whose caller timed out before they started are dropped
+            batch = [job for job in batch if job[1].set_running_or_notify_cancel()]
+            try:
+                if batch:
+                    self._commit(batch)
+            except BaseException as exc:
+                for _func, future, _queued in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                raise
+
+    def _commit(self, batch):
+        db = self._db
+        results = []
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            for func, _future, _queued in batch:
+                db.execute("SAVEPOINT job")
+                try:
+                    results.append((True, func(db)))
+                    db.execute("RELEASE job")
+                except Exception as exc:  # Handed to the waiting caller below
+                    db.execute("ROLLBACK TO job")
+                    db.execute("RELEASE job")
+                    results.append((False, exc))
+            db.execute("COMMIT")
+            self.commits += 1
+        except sqlite3.Error as exc:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            results = [(False, exc)] * len(batch)
+
+        now = time.perf_counter()
+        for (_func, future, queued), (ok, value) in zip(batch, results):
+            wait = now - queued
+            self.jobs += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if ok:
+                future.set_result(value)
+            else:
+                self.failed += 1
+                future.set_exception(value)
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "jobs": self.jobs,
+            "failed": self.failed,
+            "commits": self.commits,
+            "avg_wait_ms": (self.total_wait / self.jobs * 1000) if self.jobs else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+
+pool = ConnectionPool(DATABASE_PATH)
+atexit.register(pool.close_all)
+writer = DatabaseWriter(DATABASE_PATH)
+atexit.register(writer.stop)
+
+
+def run_write(func):
+    """
+    Runs func(db) on the single writer connection inside a committed transaction and
+    returns its result. Use for writes that need more than one statement.
+    """
+    return writer.submit(func)
+
+
+def create_connection():
+    """
+    Returns a pooled, read-only connection. Inside a request the same connection is pinned to
+    the request and handed back to the pool on app context teardown; outside of a
+    request (CLI commands, scripts) every caller gets its own connection and must
+    return it with close_connection.
+    """
+    if has_app_context():
+        if "db" not in g:
+            g.db = pool.acquire()
+        return g.db
+    return pool.acquire()
+
 def close_connection(db):
-    db.close()
+    if has_app_context() and g.get("db") is db:
+        return
+    pool.release(db)
+
+def release_request_connection(_exc=None):
+    db = g.pop("db", None)
+    if db is not None:
+        pool.release(db)
+
+@functools.lru_cache(maxsize=1024)
+def _normalized(cmd):
+    return metrics.normalize_sql(cmd)
+
+def record_statement(cmd, params, seconds, rows):
+    """
+    Records one executed statement: per-statement latency histogram, the current
+    request's query count / SQL time / rows, and the slow query log.
+    """
+    statement = _normalized(cmd)
+    metrics.statement_duration.observe(statement, seconds)
+    if plan_auditor is not None:
+        plan_auditor.observe(statement, cmd, params, seconds)
+    if has_app_context():
+        stats = g.setdefault("db_stats", {"queries": 0, "seconds": 0.0, "rows": 0})
+        stats["queries"] += 1
+        stats["seconds"] += seconds
+        stats["rows"] += rows
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        metrics.slow_statements.inc(statement)
+        logger.warning("Slow statement (%.1f ms, %d rows): %s", seconds * 1000, rows, statement)
+
+_TABLE_ALIAS = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_SCAN_DETAIL = re.compile(r"^SCAN (\w+)\b(?! VIRTUAL TABLE)")
+_ORDER_BY_FIRST = re.compile(r"\bORDER\s+BY\s+(?:(\w+)\.)?(\w+)", re.IGNORECASE)
+
+
+class QueryPlanAuditor:
+    """
+    Runs EXPLAIN QUERY PLAN once per distinct statement shape and flags full scans of
+    large tables and temporary B-tree sorts. Flagged shapes are logged when first
+    seen; every audited shape is kept with its call count and total time and saved to
+    QUERY_PLAN_AUDIT_FILE so `flask query-plans` can report on them later.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+    def observe(self, statement, cmd, params, seconds):
+        with self._lock:
+            entry = self._entries.get(statement)
+            if entry is not None:
+                entry["calls"] += 1
+                entry["total_ms"] += seconds * 1000
+                return
+            entry = self._entries[statement] = {"sql": cmd, "params": _json_params(params), "calls": 1,
+                                                "total_ms": seconds * 1000, "plan": [], "flags": []}
+        entry["plan"], entry["flags"] = explain_statement(cmd, params)
+        for flag in entry["flags"]:
+            logger.warning("Query plan: %s in %s", flag, statement)
+        self.save()
+
+    def entries(self):
+        with self._lock:
+            return {statement: dict(entry) for statement, entry in self._entries.items()}
+
+    def save(self):
+        # Written to a temp file and swapped in, so `flask query-plans` never reads a half
+        # written file and concurrent saves cannot interleave
+        with self._save_lock:
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.entries(), f, indent=2)
+            os.replace(tmp, self.path)
+
+
+def _json_params(params):
+    # BLOBs do not change the plan, so they are not worth keeping around
+    return [None if isinstance(p, (bytes, memoryview)) else p for p in params or []]
+
+def _orders_by_rowid(db, cmd, name, table):
+    """True when the statement's first ORDER BY term is the rowid (or its alias) of table."""
+    order = _ORDER_BY_FIRST.search(cmd)
+    if order is None or order.group(1) not in (None, name, table):
+        return False
+    column = order.group(2).lower()
+    if column in ("rowid", "_rowid_", "oid"):
+        return True
+    try:
+        columns = db.execute(f"PRAGMA table_info({table})").fetchall()
+    except sqlite3.Error:
+        return False
+    keys = [c for c in columns if c[5]]
+    return len(keys) == 1 and keys[0][2].upper() == "INTEGER" and keys[0][1].lower() == column
+
+def explain_statement(cmd, params):
+    """
+    Returns the EXPLAIN QUERY PLAN lines of a statement and the problems found in it:
+    scans of tables with at least AUDIT_LARGE_TABLE_ROWS rows and temp B-tree sorts. A
+    scan that walks an index, or the table in rowid order, under a LIMIT and without a
+    temp sort is stopped early and is not flagged.
+    """
+    aliases = {}
+    for table, alias in _TABLE_ALIAS.findall(cmd):
+        aliases[table] = table
+        if alias and alias.upper() not in ("ON", "WHERE", "JOIN", "LEFT", "INNER", "ORDER", "GROUP", "LIMIT",
+                                           "VALUES", "SET", "USING"):
+            aliases[alias] = table
+
+    db = create_connection()
+    try:
+        try:
+            plan = [row[3] for row in db.execute(f"EXPLAIN QUERY PLAN {cmd}", params or [])]
+        except sqlite3.Error as exc:
+            return [], [f"could not explain ({exc})"]
+        flags = []
+        # A LIMIT only stops a scan early when the rows already come out in ORDER BY order
+        limited = (re.search(r"\bLIMIT\b", cmd, re.IGNORECASE) is not None
+                   and not any("TEMP B-TREE FOR ORDER BY" in detail for detail in plan))
+        for detail in plan:
+            if "TEMP B-TREE" in detail:
+                flags.append(detail)
+            scan = _SCAN_DETAIL.match(detail)
+            if scan:
+                table = aliases.get(scan.group(1), scan.group(1))
+                if limited and (" USING " in detail or _orders_by_rowid(db, cmd, scan.group(1), table)):
+                    continue
+                try:
+                    rows = db.execute(f"SELECT MAX(rowid) FROM {table}").fetchone()[0] or 0
+                except sqlite3.Error:
+                    rows = None
+                if rows is None or rows >= AUDIT_LARGE_TABLE_ROWS:
+                    flags.append(f"{detail} (table {table}, ~{rows if rows is not None else '?'} rows)")
+        return plan, flags
+    finally:
+        close_connection(db)
+
+
+plan_auditor = QueryPlanAuditor(QUERY_PLAN_AUDIT_FILE) if QUERY_PLAN_AUDIT else None
+if plan_auditor is not None:
+    atexit.register(plan_auditor.save)
+
+
+@click.command("query-plans")
+@click.option("--file", "path", default=QUERY_PLAN_AUDIT_FILE, help="Audit file written with QUERY_PLAN_AUDIT=1.")
+@click.option("--flagged", is_flag=True, help="Only show statements with full scans or temp sorts.")
+def query_plans_command(path, flagged):
+    """Re-explain every statement recorded by the query plan audit against the current database."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            audited = json.load(f)
+    except FileNotFoundError as exc:
+        raise click.ClickException(f"{path} not found, run the app with QUERY_PLAN_AUDIT=1 first") from exc
+
+    for statement, entry in sorted(audited.items(), key=lambda item: -item[1]["total_ms"]):
+        plan, flags = explain_statement(entry["sql"], entry["params"])
+        if flagged and not flags:
+            continue
+        click.echo(f"{statement}")
+        click.echo(f"  calls={entry['calls']} total={entry['total_ms']:.1f}ms "
+                   f"avg={entry['total_ms'] / max(entry['calls'], 1):.2f}ms")
+        for detail in plan:
+            click.echo(f"  | {detail}")
+        for flag in flags:
+            click.echo(f"  ! {flag}")
+        click.echo()
+
+
+def rebuild_stats(db):
+    """
+    Recomputes recipe_stats and user_stats from the ratings, comments and recipes tables
+    on the given writer connection.
+
+    :return: The number of authors with statistics.
+    :rtype: int
+    """
+    db.execute(
+        """
+        INSERT OR REPLACE INTO recipe_stats (recipe_id, rating_sum, rating_count, comment_count)
+        SELECT r.id,
+               COALESCE((SELECT SUM(rt.rating) FROM ratings rt WHERE rt.recipe_id = r.id), 0),
+               (SELECT COUNT(*) FROM ratings rt WHERE rt.recipe_id = r.id),
+               (SELECT COUNT(*) FROM comments c WHERE c.recipe_id = r.id)
+        FROM recipes r
+        """)
+    db.execute("DELETE FROM user_stats")
+    return db.execute(
+        """
+        INSERT INTO user_stats (user_id, recipe_count, rating_sum, rating_count, comment_count)
+        SELECT r.user_id, COUNT(*), SUM(s.rating_sum), SUM(s.rating_count), SUM(s.comment_count)
+        FROM recipes r
+                 JOIN recipe_stats s ON s.recipe_id = r.id
+        GROUP BY r.user_id
+        """).rowcount
+
+
+def rebuild_summaries(db):
+    """
+    Recomputes the list summary columns of every recipe (snippet, directions_snippet,
+    ingredient_count, text_length) the same way the recipes_summary_* triggers do.
+    """
+    db.execute(
+        """
+        UPDATE recipes
+        SET snippet            = CASE WHEN length(ingredients) > 140
+                                      THEN substr(ingredients, 1, 140) || '…' ELSE ingredients END,
+            directions_snippet = CASE WHEN length(directions) > 140
+                                      THEN substr(directions, 1, 140) || '…' ELSE directions END,
+            ingredient_count   = CASE
+                WHEN trim(ingredients, char(9, 10, 13, 32, 59)) = '' THEN 0
+                WHEN instr(ingredients, char(10)) > 0
+                    THEN length(trim(ingredients, char(9, 10, 13, 32)))
+                         - length(replace(trim(ingredients, char(9, 10, 13, 32)), char(10), '')) + 1
+                ELSE length(trim(ingredients, '; ')) - length(replace(trim(ingredients, '; '), ';', '')) + 1
+            END,
+            text_length        = length(ingredients) + length(directions)
+        """)
+
+
+@click.command("rebuild-stats")
+def rebuild_stats_command():
+    """Recompute recipe_stats, user_stats and the recipe list summaries from the base tables."""
+    def rebuild(db):
+        rebuild_summaries(db)
+        return rebuild_stats(db)
+
+    click.echo(f"Rebuilt statistics for {run_write(rebuild)} author(s)")
+
+
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+def _record_request(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    stats = g.get("db_stats", {"queries": 0, "seconds": 0.0, "rows": 0})
+    metrics.request_duration.observe(route, time.perf_counter() - g.get("request_started", time.perf_counter()))
+    metrics.request_db_duration.observe(route, stats["seconds"])
+    metrics.request_queries.inc(route, stats["queries"])
+    if current_app.config.get("DB_TIMING_HEADER", False):
+        response.headers["X-DB-Time"] = f"{stats['seconds'] * 1000:.2f}ms; queries={stats['queries']}"
+    return response
+
+def metrics_gauges():
+    """Returns Prometheus text lines for the writer and write-behind buffer state."""
+    lines = []
+    for prefix, stats in (("recipes_writer", writer.stats()), ("recipes_write_buffer", write_buffer.stats())):
+        for key, value in stats.items():
+            lines.extend(metrics.gauge_lines(f"{prefix}_{key}", f"{prefix.replace('_', ' ')} {key}", value))
+    return lines
+
+def _database_busy(error):
+    logger.error("Request %s %s: %s", request.method, request.path, error)
+    return "Service busy, try again shortly", 503
+
+def init_app(app):
+    app.before_request(_start_request_timer)
+    app.after_request(_record_request)
+    app.teardown_appcontext(release_request_connection)
+    app.register_error_handler(PoolTimeout, _database_busy)
+    app.register_error_handler(WriteTimeout, _database_busy)
+    app.cli.add_command(query_plans_command)
+    app.cli.add_command(rebuild_stats_command)
+
+class Transaction:
+    """
+    Handle a unit of work (see transaction) runs its statements through. Everything
+    goes to the writer connection inside the unit's savepoint; statements are timed
+    here and recorded for the caller's request once the unit has finished.
+    """
+
+    def __init__(self, db, statements):
+        self.db = db
+        self._statements = statements
+
+    def execute(self, cmd, params=None):
+        """
+        Executes a write statement.
+
+        :return: The last inserted row id and the number of affected rows.
+        :rtype: WriteResult
+        """
+        params = [] if params is None else params
+        started = time.perf_counter()
+        cur = self.db.execute(cmd, params)
+        self._statements.append((cmd, params, time.perf_counter() - started, max(cur.rowcount, 0)))
+        return WriteResult(cur.lastrowid, cur.rowcount)
+
+    def query(self, cmd, params=None):
+        """Runs a read inside the transaction, so it sees the unit's own writes and nobody else's."""
+        params = [] if params is None else params
+        started = time.perf_counter()
+        rows = self.db.execute(cmd, params).fetchall()
+        self._statements.append((cmd, params, time.perf_counter() - started, len(rows)))
+        return rows
+
+    def write_blob(self, table, column, rowid, stream, chunk_size=BLOB_CHUNK_SIZE):
+        """
+        Copies a file-like object into an existing BLOB cell (usually created with
+        zeroblob(n)) chunk by chunk. Writing past the size of the cell raises
+        ValueError, so the cell size doubles as the upload size cap.
+
+        :return: The SHA-256 hex digest of the written bytes.
+        :rtype: str
+        """
+        digest = hashlib.sha256()
+        with self.db.blobopen(table, column, rowid) as blob:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                blob.write(chunk)
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+def transaction(func):
+    """
+    Runs func(tx) as one unit of work: a single hand-off to the writer thread, one
+    connection and one commit for every statement func issues through tx. If func
+    raises, all of its writes are rolled back and the exception is re-raised here.
+
+    :param func: Callable taking a Transaction; its return value is returned.
+    :return: Whatever func returned.
+    """
+    statements = []
+    try:
+        return run_write(lambda db: func(Transaction(db, statements)))
+    finally:
+        for cmd, params, seconds, rows in statements:
+            record_statement(cmd, params, seconds, rows)
 
 def execute_cmd(cmd, params=None):
     """
-    Executes a given SQL command with optional parameters, commits the transaction,
-    and returns the result. It ensures the database connection is properly managed
-    by opening and closing it securely within the execution cycle.
+    Executes a given SQL command with optional parameters on the writer connection
+    and returns the result once it has been committed.
 
     :param cmd: The SQL command to be executed.
     :type cmd: str
     :param params: Optional parameterized values to include in the SQL command.
                    Defaults to an empty list if no parameters are provided.
     :type params: list, optional
-    :return: The result of the executed SQL command.
-    :rtype: Any
+    :return: The last inserted row id and the number of affected rows.
+    :rtype: WriteResult
     """
-    if params is None:
-        params = []
-    db = create_connection()
-    result = db.execute(cmd, params)
-    db.commit()
-    close_connection(db)
-    return result
+    return transaction(lambda tx: tx.execute(cmd, params))
+
+class WriteBuffer:
+    """
+    Write-behind buffer for fire-and-forget inserts (page visits, audit logs).
+    Events are queued in memory and a background thread writes them with one
+    executemany per statement inside a single transaction, either when
+    flush_size events are pending or every flush_interval seconds. Pending events
+    are flushed at process exit. When max_pending events are already queued new
+    ones are dropped instead of blocking the caller.
+    """
+
+    def __init__(self, max_pending=WRITE_BUFFER_MAX_PENDING, flush_size=WRITE_BUFFER_FLUSH_SIZE,
+                 flush_interval=WRITE_BUFFER_FLUSH_INTERVAL):
+        self.max_pending = max_pending
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._events = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.flushed = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+
+    def enqueue(self, cmd, params):
+        with self._lock:
+            if len(self._events) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._events.append((cmd, params))
+            pending = len(self._events)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="write-buffer", daemon=True)
+                self._thread.start()
+        if pending >= self.flush_size:
+            self._wakeup.set()
+        return True
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                events = list(self._events)
+                self._events.clear()
+            if not events:
+                return 0
+
+            batches = {}
+            for cmd, params in events:
+                batches.setdefault(cmd, []).append(params)
+
+            def write(db):
+                for cmd, rows in batches.items():
+                    db.executemany(cmd, rows)
+
+            try:
+                run_write(write)
+            except sqlite3.Error:
+                self.failed_flushes += 1
+                self.dropped += len(events)
+                return 0
+            self.flushed += len(events)
+            return len(events)
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._events)
+        return {
+            "pending": pending,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+write_buffer = WriteBuffer()
+atexit.register(write_buffer.flush)
+
+
+def add_visit():
+    write_buffer.enqueue("INSERT INTO visits (last_visit) VALUES (?)", [time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())])
 
 def create_log(message):
-    execute_cmd("INSERT INTO logs (message) VALUES (?)", [message]);
+    write_buffer.enqueue("INSERT INTO logs (message, created_at) VALUES (?, ?)", [message, int(time.time())])
+
+
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+atexit.register(db_executor.shutdown, wait=False, cancel_futures=True)
+
+
+async def run_in_db(func, *args):
+    """
+    Runs a blocking database function on the bounded db_executor, so coroutines never
+    block the event loop on sqlite3 calls.
+    """
+    return await asyncio.get_running_loop().run_in_executor(db_executor, func, *args)
+
+async def run_query_async(cmd, params=None, no_factory=False):
+    """Async counterpart of run_query, executed on db_executor."""
+    return await run_in_db(run_query, cmd, params, no_factory)
+
+async def stream_blob_async(table, column, rowid, start=0, end=None, chunk_size=BLOB_CHUNK_SIZE):
+    """
+    Async counterpart of stream_blob. Every chunk is read on db_executor with a
+    connection borrowed just for that chunk, so a slow client holds neither a thread
+    nor a pooled connection while it drains the body.
+    """
+    if end is None:
+        rows = await run_query_async(f"SELECT length({column}) FROM {table} WHERE rowid = ?", [rowid])
+        end = rows[0][0] if rows else 0
+    offset = start
+    while offset < end:
+        chunk = await run_in_db(read_blob, table, column, rowid, min(chunk_size, end - offset), offset)
+        if not chunk:
+            break
+        offset += len(chunk)
+        yield chunk
 
 
 def run_query(cmd, params=None, no_factory=False):
     """
-    Executes a SQL query against the database and returns the result. Establishes a
-    connection to the database, optionally disables the row factory, executes the
-    query with given parameters, and fetches all results before closing the
-    connection.
+    Executes a SQL query against the database and returns the result. Borrows a
+    pooled connection, optionally disables the row factory, executes the query
+    with given parameters, and fetches all results before handing the connection
+    back.
 
     :param cmd: The SQL command/query to execute.
     :type cmd: str
@@ -55,19 +811,184 @@ def run_query(cmd, params=None, no_factory=False):
     if params is None:
         params = []
     db = create_connection()
-    if no_factory:
-        db.row_factory = None
-    result = db.execute(cmd, params).fetchall()
-    close_connection(db)
+    started = time.perf_counter()
+    try:
+        if no_factory:
+            db.row_factory = None
+        result = db.execute(cmd, params).fetchall()
+    finally:
+        close_connection(db)
+    record_statement(cmd, params, time.perf_counter() - started, len(result))
     return result
 
+def stream_blob(table, column, rowid, start=0, end=None, chunk_size=BLOB_CHUNK_SIZE, db=None):
+    """
+    Yields the bytes of a BLOB cell in chunks using SQLite incremental blob I/O, so
+    large values are never loaded into memory at once. The connection is taken when
+    iteration starts: inside an app context that is the request's own connection,
+    otherwise (a response body sent after the request has ended) a pooled one that is
+    handed back when the generator is exhausted or closed.
+
+    :param table: Table holding the BLOB.
+    :param column: BLOB column name.
+    :param rowid: Row id of the cell.
+    :param start: First byte offset to yield.
+    :param end: Offset one past the last byte to yield; defaults to the BLOB length.
+    :param chunk_size: Maximum number of bytes per chunk.
+    :param db: Connection to read with instead, left open for its owner.
+    """
+    owned = db is None
+    if owned:
+        db = create_connection()
+    try:
+        with db.blobopen(table, column, rowid, readonly=True) as blob:
+            end = len(blob) if end is None else min(end, len(blob))
+            blob.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = blob.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    finally:
+        if owned:
+            close_connection(db)
+
+def write_blob(table, column, rowid, stream, chunk_size=BLOB_CHUNK_SIZE):
+    """
+    Copies a file-like object into an existing BLOB cell and commits, see
+    Transaction.write_blob.
+
+    :return: The SHA-256 hex digest of the written bytes.
+    :rtype: str
+    """
+    return transaction(lambda tx: tx.write_blob(table, column, rowid, stream, chunk_size))
+
+def read_blob(table, column, rowid, length, start=0, db=None):
+    """Reads up to length bytes of a BLOB cell starting at start."""
+    return b"".join(stream_blob(table, column, rowid, start, start + length, db=db))
+
+def hash_blob(table, column, rowid, db=None):
+    """Returns the SHA-256 hex digest of a BLOB cell, computed chunk by chunk."""
+    digest = hashlib.sha256()
+    for chunk in stream_blob(table, column, rowid, db=db):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def sniff_image_type(header):
+    """
+    Detects the image type from the first bytes of a file.
+
+    :param header: At least the first 12 bytes of the file.
+    :type header: bytes
+    :return: The MIME type, or None if the format is not a supported image.
+    :rtype: str or None
+    """
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header.startswith(b"GIF87a") or header.startswith(b"GIF89a"):
+        return "image/gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+class BatchLoader:
+    """
+    Collects ids that a view is going to need and resolves them with a single
+    ``IN (...)`` query, memoizing the results. Ids can be registered up front with
+    prime() so that the first load() fetches all of them in one round trip.
+
+    :param fetch: Callable that takes a list of ids and returns a dict of id -> value.
+    :param default: Value returned for ids the fetch did not return a row for.
+    """
+
+    MAX_BATCH = 500
+
+    def __init__(self, fetch, default=None):
+        self.fetch = fetch
+        self.default = default
+        self._pending = set()
+        self._cache = {}
+
+    def prime(self, ids):
+        self._pending.update(i for i in ids if i not in self._cache)
+
+    def load_many(self, ids):
+        ids = list(ids)
+        self.prime(ids)
+        if self._pending:
+            pending = list(self._pending)
+            self._pending.clear()
+            for i in range(0, len(pending), self.MAX_BATCH):
+                chunk = pending[i:i + self.MAX_BATCH]
+                found = self.fetch(chunk)
+                for key in chunk:
+                    self._cache[key] = found.get(key, self.default)
+        return {key: self._cache[key] for key in ids}
+
+    def load(self, key):
+        return self.load_many([key])[key]
+
+    def clear(self):
+        self._pending.clear()
+        self._cache.clear()
+
+
+def _placeholders(ids):
+    return ", ".join("?" for _ in ids)
+
+def _fetch_avg_ratings(ids):
+    rows = run_query(
+        f"SELECT recipe_id, avg_rating, rating_count FROM recipe_stats WHERE recipe_id IN ({_placeholders(ids)})",
+        ids)
+    return {row[0]: (round(row[1], 1) if row[1] is not None else 0, row[2] or 0) for row in rows}
+
+def _user_ratings_fetcher(user_id):
+    def fetch(ids):
+        rows = run_query(
+            f"SELECT recipe_id, rating FROM ratings WHERE user_id = ? AND recipe_id IN ({_placeholders(ids)})",
+            [user_id] + ids)
+        return {row[0]: row[1] for row in rows}
+    return fetch
+
+def get_loader(kind, user_id=None):
+    """
+    Returns the request-scoped loader for a kind of per-recipe lookup ("rating" or
+    "user_rating"). Loaders live on flask.g, so every view and action in
+    the same request shares their memoized results. Outside of a request a fresh,
+    unshared loader is returned.
+    """
+    if kind == "rating":
+        factory = functools.partial(BatchLoader, _fetch_avg_ratings, default=(0, 0))
+    elif kind == "user_rating":
+        factory = functools.partial(BatchLoader, _user_ratings_fetcher(user_id))
+    else:
+        raise ValueError(f"Unknown loader kind: {kind}")
+
+    if not has_app_context():
+        return factory()
+    loaders = g.setdefault("loaders", {})
+    key = (kind, user_id)
+    if key not in loaders:
+        loaders[key] = factory()
+    return loaders[key]
+
+def clear_loaders():
+    """Drops memoized lookups for the current request, e.g. after a write changed them."""
+    if has_app_context():
+        g.pop("loaders", None)
+
 def get_avg_rating(recipe_id):
     """
-    Calculates the average rating for a given recipe based on ratings stored in the database.
+    Returns the average rating for a given recipe from the precomputed recipe_stats row.
 
-    This function queries the database for ratings associated with a specific recipe ID,
-    calculates their average, and returns the rounded result. If there are no ratings for
-    the given recipe, it defaults to 0.
+    The lookup goes through the request-scoped "rating" loader, so ids registered
+    earlier in the request are fetched together in one query. If there are no
+    ratings for the given recipe, it defaults to 0.
 
     :param recipe_id: The unique identifier of the recipe for which the average rating is
         being calculated.
@@ -75,17 +996,204 @@ def get_avg_rating(recipe_id):
     :return: A tuple containing the rounded average rating and rating count.
     :rtype: tuple
     """
-    result = run_query("SELECT AVG(rating), COUNT(*) FROM ratings WHERE recipe_id = ?", [recipe_id])
-    if len(result) == 0:
-        return 0
-    return round(result[0][0], 1) if result and result[0][0] is not None else 0, result[0][1] if result and result[0][1] is not None else 0
+    return get_loader("rating").load(recipe_id)
+
+def get_avg_ratings(recipe_ids):
+    """
+    Batch version of get_avg_rating.
+
+    :param recipe_ids: The recipe ids to look up.
+    :type recipe_ids: list
+    :return: A dict of recipe id -> (rounded average rating, rating count).
+    :rtype: dict
+    """
+    return get_loader("rating").load_many(recipe_ids)
+
+def get_user_ratings(user_id, recipe_ids):
+    """
+    Returns a dict of recipe id -> the rating given by user_id, or None if the user
+    has not rated that recipe.
+    """
+    return get_loader("user_rating", user_id).load_many(recipe_ids)
+
+def build_fts_query(q):
+    """
+    Turns free-form search input into a safe FTS5 MATCH expression. Every word is
+    quoted (so FTS operators in user input are treated as plain text) and matched
+    as a prefix, and all words must be present.
+
+    :param q: The raw search string from the request.
+    :type q: str
+    :return: The MATCH expression, or None if the input contains no searchable words.
+    :rtype: str or None
+    """
+    terms = re.findall(r"\w+", q or "")
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+class CategoryCache:
+    """
+    In-process cache of the categories table, which almost never changes. Serves the
+    name-ordered list used by the recipe forms and filters and an id set for O(1)
+    existence checks.
+
+    The cache reloads when its version is bumped with invalidate() (for changes made
+    by this process) or when it is older than ttl seconds (for changes made directly
+    in the database, e.g. by init.sql).
+    """
+
+    def __init__(self, ttl=REFERENCE_CACHE_TTL):
+        self.ttl = ttl
+        self.version = 0
+        self._lock = threading.Lock()
+        self._loaded = None
+
+    def _current(self):
+        loaded = self._loaded
+        if loaded is not None and loaded[0] == self.version and time.monotonic() - loaded[1] < self.ttl:
+            return loaded
+        with self._lock:
+            version = self.version
+            rows = run_query("SELECT id, name FROM categories ORDER BY name")
+            self._loaded = (version, time.monotonic(), rows, frozenset(row[0] for row in rows))
+            return self._loaded
+
+    def all(self):
+        return self._current()[2]
+
+    def exists(self, category_id):
+        return category_id in self._current()[3]
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+
+
+categories_cache = CategoryCache()
+
+
+def get_categories():
+    """
+    Returns all categories as (id, name) rows ordered by name, from the in-process cache.
+    """
+    return categories_cache.all()
+
+def category_exists(category_id):
+    """
+    Checks whether a category id exists, without a database round trip.
+    """
+    return categories_cache.exists(category_id)
+
+class RecipePageCache:
+    """
+    LRU cache of the parts of the recipe detail page that are the same for every
+    viewer (recipe row, rating summary, comments and the pre-rendered body), keyed
+    by recipe id.
+
+    Actions that change a recipe call invalidate(recipe_id). Each entry also expires
+    after ttl seconds so that changes made by other worker processes show up. Every
+    entry gets a random token on build, which views use to derive their ETag.
+    """
+
+    def __init__(self, max_entries=RECIPE_CACHE_MAX_ENTRIES, ttl=RECIPE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, recipe_id, build):
+        """
+        Returns the cached entry for recipe_id, building it with build(recipe_id) on a
+        miss. build returns a dict, or None if the recipe does not exist (not cached).
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(recipe_id)
+            if cached is not None and now - cached[0] < self.ttl:
+                self._entries.move_to_end(recipe_id)
+                return cached[1]
+            version = self._versions.get(recipe_id, 0)
+
+        entry = build(recipe_id)
+        if entry is None:
+            return None
+        entry["token"] = uuid.uuid4().hex
+
+        with self._lock:
+            # Skip storing if the recipe was invalidated while the entry was being built
+            if self._versions.get(recipe_id, 0) == version:
+                self._entries[recipe_id] = (now, entry)
+                self._entries.move_to_end(recipe_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def peek(self, recipe_id):
+        """Returns the cached entry without building or refreshing it, or None."""
+        with self._lock:
+            cached = self._entries.get(recipe_id)
+            if cached is None or time.monotonic() - cached[0] >= self.ttl:
+                return None
+            return cached[1]
+
+    def invalidate(self, recipe_id):
+        with self._lock:
+            self._entries.pop(recipe_id, None)
+            self._versions[recipe_id] = self._versions.get(recipe_id, 0) + 1
+
+
+recipe_cache = RecipePageCache()
+
+
+def encode_cursor(*values):
+    """
+    Packs keyset pagination values (e.g. the sort score and id of a boundary row)
+    into an opaque, URL-safe token.
+    """
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(token, size):
+    """
+    Reverses encode_cursor. Returns None for an empty token and aborts with 400 if
+    the token was not produced by encode_cursor or does not hold size values.
+    """
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (binascii.Error, ValueError):
+        abort(400)
+    if not isinstance(values, list) or len(values) != size or not all(isinstance(v, (int, float)) for v in values):
+        abort(400)
+    return values
+
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="password")
+atexit.register(password_executor.shutdown, wait=False, cancel_futures=True)
+_password_checks = threading.BoundedSemaphore(MAX_PENDING_PASSWORD_CHECKS)
+
+
+def verify_password(stored, password):
+    """
+    Compares the stored password of a user with the one given at login. Runs on
+    password_executor, so a slow password hash can be dropped in here without
+    blocking request threads. A missing or empty password never matches.
+    """
+    if not password:
+        return False
+    # Hash fix
+    # return hmac.compare_digest(stored or "", hashlib.sha256(password.encode()).hexdigest())
+    return hmac.compare_digest((stored or "").encode(), password.encode())
 
 def validate_credentials(username, password):
     """
-    Validates user credentials against a database. The function hashes the provided
-    password using SHA-256, then compares the resulting hash and username with
-    entries in the database. If a matching user is found, their details are returned;
-    otherwise, None is returned.
+    Validates user credentials against a database. The user is looked up by
+    username (served by the unique username index) and the password is checked with
+    verify_password on the bounded password_executor. If a matching user is found,
+    their details are returned; otherwise, None is returned. Aborts with 503 when
+    MAX_PENDING_PASSWORD_CHECKS logins are already waiting.
 
     :param username: The username of the user attempting to log in.
     :type username: str
@@ -95,11 +1203,16 @@ def validate_credentials(username, password):
         otherwise None.
     :rtype: dict or None
     """
-    # Hash fix
-    # hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    # result = run_query("SELECT id, username, password FROM users WHERE username = ? AND password = ?", [username, hashed_password])
-    result = run_query("SELECT id, username, password FROM users WHERE username = ? AND password = ?", [username, password])
-    return None if len(result) == 0 else result[0]
+    result = run_query("SELECT id, username, password FROM users WHERE username = ?", [username])
+    if len(result) == 0:
+        return None
+    if not _password_checks.acquire(blocking=False):
+        abort(503)
+    try:
+        valid = password_executor.submit(verify_password, result[0][2], password).result()
+    finally:
+        _password_checks.release()
+    return result[0] if valid else None
 
 
 def validate_input_recipe(name, ingredients, directions, min_recipe_name_len, max_recipe_name_len, min_ingredients_len,
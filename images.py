@@ -0,0 +1,282 @@
+import atexit
+import hashlib
+import io
+import logging
+import multiprocessing
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+from werkzeug.http import parse_etags, parse_range_header, quote_etag
+
+from helpers import (DATABASE_PATH, create_connection, close_connection, transaction, run_query, read_blob, hash_blob,
+                     sniff_image_type)
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, covers are then only served in their original size
+    Image = None
+
+# Longest edge in pixels for each derivative; "original" is the uploaded file in recipe_images
+VARIANT_SIZES = {
+    "thumb": 160,
+    "medium": 640,
+}
+RESIZE_WORKERS = 2
+MAX_PENDING_RESIZES = 8
+
+logger = logging.getLogger("recipes.images")
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(MAX_PENDING_RESIZES)
+
+
+def resize_image(recipe_id, sizes=None):
+    """
+    Produces the resized derivatives of a recipe cover. Runs inside the resize process
+    pool, so it reads the original with its own connection (pooled connections must not
+    cross a fork) and only returns plain values.
+
+    Sizes the original is already within are skipped, as are variants that encode no
+    smaller than the original file; the cover route falls back to the next larger
+    variant (or the original) for those.
+
+    :param recipe_id: The recipe whose cover in recipe_images is resized.
+    :type recipe_id: int
+    :param sizes: Mapping of variant name -> longest edge in pixels. Defaults to VARIANT_SIZES.
+    :type sizes: dict, optional
+    :return: A list of (variant name, image bytes, mime type, width, height).
+    :rtype: list
+    """
+    sizes = sizes or VARIANT_SIZES
+    variants = []
+    db = sqlite3.connect(DATABASE_PATH)
+    try:
+        with db.blobopen("recipe_images", "image", recipe_id, readonly=True) as blob:
+            data = blob.read()
+    finally:
+        db.close()
+    with Image.open(io.BytesIO(data)) as original:
+        original.load()
+        has_alpha = original.mode in ("RGBA", "LA", "PA") or "transparency" in original.info
+        for name, edge in sizes.items():
+            if max(original.size) <= edge:
+                continue
+            img = original.convert("RGBA" if has_alpha else "RGB")
+            img.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+            out = io.BytesIO()
+            if has_alpha:
+                img.save(out, format="PNG", optimize=True)
+                mime_type = "image/png"
+            else:
+                img.save(out, format="JPEG", quality=82, optimize=True, progressive=True)
+                mime_type = "image/jpeg"
+            if out.tell() >= len(data):
+                continue
+            variants.append((name, out.getvalue(), mime_type, img.width, img.height))
+    return variants
+
+
+def store_variants(recipe_id, variants):
+    def store(tx):
+        # Replaces the whole set, so a variant that is no longer worth keeping goes away
+        tx.execute("DELETE FROM recipe_image_variants WHERE recipe_id = ?", [recipe_id])
+        for name, data, mime_type, width, height in variants:
+            tx.execute(
+                """
+                INSERT OR REPLACE INTO recipe_image_variants (recipe_id, size, image, mime_type, content_hash, width,
+                                                              height)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [recipe_id, name, data, mime_type, hashlib.sha256(data).hexdigest(), width, height])
+
+    transaction(store)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawned, not forked: the app has threads (writer, executors) and open SQLite
+            # connections that a forked child would inherit in an undefined state
+            _executor = ProcessPoolExecutor(max_workers=RESIZE_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+            atexit.register(_executor.shutdown, wait=False, cancel_futures=True)
+        return _executor
+
+
+def schedule_variants(recipe_id):
+    """
+    Queues derivative generation for a newly uploaded cover without blocking the
+    caller. At most MAX_PENDING_RESIZES images are in flight; beyond that (or when
+    Pillow is not installed) nothing is queued and the image can be picked up later
+    by `flask backfill-image-variants`.
+
+    :return: True if the image was queued.
+    :rtype: bool
+    """
+    if Image is None or not _pending.acquire(blocking=False):
+        return False
+
+    def done(future):
+        try:
+            exc = future.exception()
+            if exc is not None:
+                logger.error("Recipe %s: could not resize cover", recipe_id, exc_info=exc)
+                return
+            store_variants(recipe_id, future.result())
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Recipe %s: could not store cover variants", recipe_id)
+        finally:
+            _pending.release()
+
+    try:
+        future = _get_executor().submit(resize_image, recipe_id)
+    except RuntimeError:
+        _pending.release()
+        return False
+    future.add_done_callback(done)
+    return True
+
+
+def get_cover_source(recipe_id, size):
+    """
+    Picks the stored image that should be served for a cover request.
+
+    :return: (table, rowid, mime type, content hash, length) or None if the recipe has no cover.
+    :rtype: tuple or None
+    """
+    if size in VARIANT_SIZES:
+        # Prefer the requested size, then larger derivatives, before falling back to the original
+        candidates = [name for name, edge in VARIANT_SIZES.items() if edge >= VARIANT_SIZES[size]]
+        rows = run_query(
+            f"""
+            SELECT rowid, size, mime_type, content_hash, length(image)
+            FROM recipe_image_variants
+            WHERE recipe_id = ? AND size IN ({", ".join("?" for _ in candidates)})
+            """,
+            [recipe_id] + candidates)
+        if rows:
+            row = min(rows, key=lambda r: VARIANT_SIZES[r[1]])
+            return "recipe_image_variants", row[0], row[2], row[3], row[4]
+
+    rows = run_query("SELECT mime_type, content_hash, length(image) FROM recipe_images WHERE recipe_id = ? LIMIT 1",
+                     [recipe_id])
+    if not rows:
+        return None
+    return "recipe_images", recipe_id, rows[0][0], rows[0][1], rows[0][2]
+
+
+def plan_cover_response(recipe_id, size, if_none_match=None, range_header=None):
+    """
+    Works out how a cover request should be answered, without reading the image
+    itself. Shared by the Flask route and the ASGI cover handler, which only differ
+    in how they stream the body.
+
+    :param recipe_id: The recipe whose cover is requested.
+    :param size: Requested variant name ("thumb", "medium" or "original").
+    :param if_none_match: Raw If-None-Match header, if any.
+    :param range_header: Raw Range header, if any.
+    :return: None if the recipe has no cover, otherwise (status, headers, body) where
+        body holds the stream_blob arguments (table, column, rowid, start, end), or None
+        if the response has no body.
+    :rtype: tuple or None
+    """
+    source = get_cover_source(recipe_id, size)
+    if source is None:
+        return None
+    table, rowid, ctype, content_hash, length = source
+    ctype = ctype or "application/octet-stream"
+
+    # Images stored before types and hashes were recorded at upload (until
+    # `flask backfill-image-hashes` has run) are sniffed and hashed per request, reading
+    # on the caller's connection: the request's pinned one, or one borrowed here
+    if ctype == "application/octet-stream" or content_hash is None:
+        db = create_connection()
+        try:
+            if ctype == "application/octet-stream":
+                ctype = sniff_image_type(read_blob(table, "image", rowid, 12, db=db)) or ctype
+            if content_hash is None:
+                content_hash = hash_blob(table, "image", rowid, db=db)
+        finally:
+            close_connection(db)
+
+    headers = {
+        "ETag": quote_etag(content_hash),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, max-age=86400",
+    }
+    if parse_etags(if_none_match).contains(content_hash):
+        return 304, headers, None
+
+    byte_range = None
+    if range_header:
+        parsed = parse_range_header(range_header)
+        byte_range = parsed.range_for_length(length) if parsed else None
+        if byte_range is None:
+            headers["Content-Range"] = f"bytes */{length}"
+            return 416, headers, None
+
+    start, end = byte_range or (0, length)
+    headers["Content-Type"] = ctype
+    headers["Content-Length"] = str(end - start)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{length}"
+    return 206 if byte_range else 200, headers, (table, "image", rowid, start, end)
+
+
+@click.command("backfill-image-variants")
+@click.option("--force", is_flag=True, help="Regenerate variants that already exist.")
+def backfill_image_variants_command(force):
+    """Generate thumbnail and medium covers for images uploaded before variants existed."""
+    if Image is None:
+        raise click.ClickException("Pillow is required to generate image variants (pip install pillow)")
+
+    where = "" if force else "WHERE NOT EXISTS (SELECT 1 FROM recipe_image_variants v WHERE v.recipe_id = i.recipe_id)"
+    ids = [row[0] for row in run_query(f"SELECT i.recipe_id FROM recipe_images i {where} ORDER BY i.recipe_id")]
+
+    executor = _get_executor()
+    done = 0
+    for start in range(0, len(ids), MAX_PENDING_RESIZES):
+        batch = ids[start:start + MAX_PENDING_RESIZES]
+        futures = [(recipe_id, executor.submit(resize_image, recipe_id)) for recipe_id in batch]
+        for recipe_id, future in futures:
+            try:
+                store_variants(recipe_id, future.result())
+                done += 1
+            except (OSError, ValueError) as exc:
+                click.echo(f"Recipe {recipe_id}: could not resize cover ({exc})", err=True)
+    click.echo(f"Generated variants for {done} of {len(ids)} image(s)")
+
+
+@click.command("backfill-image-hashes")
+def backfill_image_hashes_command():
+    """Store the content hash and type of covers uploaded before they were recorded."""
+    rows = run_query(
+        """
+        SELECT 'recipe_images', rowid, mime_type, content_hash FROM recipe_images
+        WHERE content_hash IS NULL OR mime_type IS NULL OR mime_type = 'application/octet-stream'
+        UNION ALL
+        SELECT 'recipe_image_variants', rowid, mime_type, content_hash FROM recipe_image_variants
+        WHERE content_hash IS NULL
+        """)
+    updates = []
+    for table, rowid, mime_type, content_hash in rows:
+        if mime_type in (None, "application/octet-stream"):
+            mime_type = sniff_image_type(read_blob(table, "image", rowid, 12)) or mime_type
+        updates.append((table, rowid, mime_type, content_hash or hash_blob(table, "image", rowid)))
+
+    def store(tx):
+        for table, rowid, mime_type, content_hash in updates:
+            tx.execute(f"UPDATE {table} SET mime_type = ?, content_hash = ? WHERE rowid = ?",
+                       [mime_type, content_hash, rowid])
+
+    transaction(store)
+    click.echo(f"Updated {len(updates)} image(s)")
+
+
+def init_app(app):
+    app.cli.add_command(backfill_image_variants_command)
+    app.cli.add_command(backfill_image_hashes_command)
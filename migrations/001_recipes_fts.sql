@@ -0,0 +1,34 @@
+-- Migration: add the recipes_fts full-text index to an existing database and index the current rows
+-- Usage: sqlite3 database.db < migrations/001_recipes_fts.sql
+
+BEGIN TRANSACTION;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS recipes_fts USING fts5(
+    name,
+    ingredients,
+    directions,
+    content='recipes',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS recipes_fts_ai AFTER INSERT ON recipes BEGIN
+    INSERT INTO recipes_fts (rowid, name, ingredients, directions)
+    VALUES (new.id, new.name, new.ingredients, new.directions);
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipes_fts_ad AFTER DELETE ON recipes BEGIN
+    INSERT INTO recipes_fts (recipes_fts, rowid, name, ingredients, directions)
+    VALUES ('delete', old.id, old.name, old.ingredients, old.directions);
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipes_fts_au AFTER UPDATE OF name, ingredients, directions ON recipes BEGIN
+    INSERT INTO recipes_fts (recipes_fts, rowid, name, ingredients, directions)
+    VALUES ('delete', old.id, old.name, old.ingredients, old.directions);
+    INSERT INTO recipes_fts (rowid, name, ingredients, directions)
+    VALUES (new.id, new.name, new.ingredients, new.directions);
+END;
+
+INSERT INTO recipes_fts (recipes_fts) VALUES ('rebuild');
+
+COMMIT;
@@ -0,0 +1,59 @@
+-- Migration: add recipe_stats and backfill it from the existing ratings and comments
+-- Usage: sqlite3 database.db < migrations/002_recipe_stats.sql
+
+BEGIN TRANSACTION;
+
+CREATE TABLE IF NOT EXISTS recipe_stats (
+    recipe_id     INTEGER PRIMARY KEY,
+    rating_sum    INTEGER NOT NULL DEFAULT 0,
+    rating_count  INTEGER NOT NULL DEFAULT 0,
+    comment_count INTEGER NOT NULL DEFAULT 0,
+    avg_rating    REAL GENERATED ALWAYS AS (
+        CASE WHEN rating_count > 0 THEN CAST(rating_sum AS REAL) / rating_count ELSE 0 END
+    ) VIRTUAL,
+    FOREIGN KEY (recipe_id) REFERENCES recipes(id) ON DELETE CASCADE
+);
+
+-- Serves the top recipes on / straight from the index
+CREATE INDEX IF NOT EXISTS idx_recipe_stats_top ON recipe_stats(avg_rating DESC, rating_count DESC, recipe_id DESC);
+
+CREATE TRIGGER IF NOT EXISTS recipe_stats_recipe_ai AFTER INSERT ON recipes BEGIN
+    INSERT OR IGNORE INTO recipe_stats (recipe_id) VALUES (new.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipe_stats_rating_ai AFTER INSERT ON ratings BEGIN
+    INSERT INTO recipe_stats (recipe_id, rating_sum, rating_count) VALUES (new.recipe_id, new.rating, 1)
+    ON CONFLICT (recipe_id) DO UPDATE SET rating_sum   = rating_sum + excluded.rating_sum,
+                                          rating_count = rating_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipe_stats_rating_au AFTER UPDATE OF rating, recipe_id ON ratings BEGIN
+    UPDATE recipe_stats SET rating_sum = rating_sum - old.rating, rating_count = rating_count - 1
+    WHERE recipe_id = old.recipe_id;
+    INSERT INTO recipe_stats (recipe_id, rating_sum, rating_count) VALUES (new.recipe_id, new.rating, 1)
+    ON CONFLICT (recipe_id) DO UPDATE SET rating_sum   = rating_sum + excluded.rating_sum,
+                                          rating_count = rating_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipe_stats_rating_ad AFTER DELETE ON ratings BEGIN
+    UPDATE recipe_stats SET rating_sum = rating_sum - old.rating, rating_count = rating_count - 1
+    WHERE recipe_id = old.recipe_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipe_stats_comment_ai AFTER INSERT ON comments BEGIN
+    INSERT INTO recipe_stats (recipe_id, comment_count) VALUES (new.recipe_id, 1)
+    ON CONFLICT (recipe_id) DO UPDATE SET comment_count = comment_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipe_stats_comment_ad AFTER DELETE ON comments BEGIN
+    UPDATE recipe_stats SET comment_count = comment_count - 1 WHERE recipe_id = old.recipe_id;
+END;
+
+INSERT OR REPLACE INTO recipe_stats (recipe_id, rating_sum, rating_count, comment_count)
+SELECT r.id,
+       COALESCE((SELECT SUM(rt.rating) FROM ratings rt WHERE rt.recipe_id = r.id), 0),
+       (SELECT COUNT(*) FROM ratings rt WHERE rt.recipe_id = r.id),
+       (SELECT COUNT(*) FROM comments c WHERE c.recipe_id = r.id)
+FROM recipes r;
+
+COMMIT;
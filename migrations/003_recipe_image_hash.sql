@@ -0,0 +1,6 @@
+-- Migration: add the SHA-256 content hash used as the ETag for recipe covers
+-- Usage: sqlite3 database.db < migrations/003_recipe_image_hash.sql
+-- Then store the hashes of existing images with `flask backfill-image-hashes`; until then they are
+-- hashed on every request.
+
+ALTER TABLE recipe_images ADD COLUMN content_hash TEXT;
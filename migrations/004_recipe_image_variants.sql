@@ -0,0 +1,15 @@
+-- Migration: add the table holding resized cover images
+-- Usage: sqlite3 database.db < migrations/004_recipe_image_variants.sql
+-- Then generate variants for existing covers with `flask backfill-image-variants`.
+
+CREATE TABLE IF NOT EXISTS recipe_image_variants (
+    recipe_id INTEGER NOT NULL,
+    size TEXT NOT NULL,
+    image BLOB NOT NULL,
+    mime_type TEXT,
+    content_hash TEXT,
+    width INTEGER,
+    height INTEGER,
+    PRIMARY KEY (recipe_id, size),
+    FOREIGN KEY (recipe_id) REFERENCES recipe_images(recipe_id) ON DELETE CASCADE
+);
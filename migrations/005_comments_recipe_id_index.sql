@@ -0,0 +1,9 @@
+-- Migration: replace the per-recipe comments index with one on (recipe_id, id) used for comment paging
+-- Usage: sqlite3 database.db < migrations/005_comments_recipe_id_index.sql
+
+BEGIN TRANSACTION;
+
+CREATE INDEX IF NOT EXISTS idx_comments_recipe_id ON comments(recipe_id, id);
+DROP INDEX IF EXISTS idx_comments_recipe;
+
+COMMIT;
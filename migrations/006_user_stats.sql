@@ -0,0 +1,66 @@
+-- Migration: add user_stats and backfill it from the existing recipes, ratings and comments
+-- Usage: sqlite3 database.db < migrations/006_user_stats.sql
+-- The totals can be recomputed at any time with `flask rebuild-stats`.
+
+BEGIN TRANSACTION;
+
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id       INTEGER PRIMARY KEY,
+    recipe_count  INTEGER NOT NULL DEFAULT 0,
+    rating_sum    INTEGER NOT NULL DEFAULT 0,
+    rating_count  INTEGER NOT NULL DEFAULT 0,
+    comment_count INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+CREATE TRIGGER IF NOT EXISTS user_stats_recipe_ai AFTER INSERT ON recipes BEGIN
+    INSERT INTO user_stats (user_id, recipe_count) VALUES (new.user_id, 1)
+    ON CONFLICT (user_id) DO UPDATE SET recipe_count = recipe_count + 1;
+END;
+
+-- BEFORE so the recipe's totals can still be read; the cascaded rating and comment
+-- deletes that follow no longer find the recipe and leave user_stats alone
+CREATE TRIGGER IF NOT EXISTS user_stats_recipe_bd BEFORE DELETE ON recipes BEGIN
+    UPDATE user_stats
+    SET recipe_count  = recipe_count - 1,
+        rating_sum    = rating_sum - COALESCE((SELECT rating_sum FROM recipe_stats WHERE recipe_id = old.id), 0),
+        rating_count  = rating_count - COALESCE((SELECT rating_count FROM recipe_stats WHERE recipe_id = old.id), 0),
+        comment_count = comment_count - COALESCE((SELECT comment_count FROM recipe_stats WHERE recipe_id = old.id), 0)
+    WHERE user_id = old.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_rating_ai AFTER INSERT ON ratings BEGIN
+    UPDATE user_stats SET rating_sum = rating_sum + new.rating, rating_count = rating_count + 1
+    WHERE user_id = (SELECT user_id FROM recipes WHERE id = new.recipe_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_rating_au AFTER UPDATE OF rating, recipe_id ON ratings BEGIN
+    UPDATE user_stats SET rating_sum = rating_sum - old.rating, rating_count = rating_count - 1
+    WHERE user_id = (SELECT user_id FROM recipes WHERE id = old.recipe_id);
+    UPDATE user_stats SET rating_sum = rating_sum + new.rating, rating_count = rating_count + 1
+    WHERE user_id = (SELECT user_id FROM recipes WHERE id = new.recipe_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_rating_ad AFTER DELETE ON ratings BEGIN
+    UPDATE user_stats SET rating_sum = rating_sum - old.rating, rating_count = rating_count - 1
+    WHERE user_id = (SELECT user_id FROM recipes WHERE id = old.recipe_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_comment_ai AFTER INSERT ON comments BEGIN
+    UPDATE user_stats SET comment_count = comment_count + 1
+    WHERE user_id = (SELECT user_id FROM recipes WHERE id = new.recipe_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_comment_ad AFTER DELETE ON comments BEGIN
+    UPDATE user_stats SET comment_count = comment_count - 1
+    WHERE user_id = (SELECT user_id FROM recipes WHERE id = old.recipe_id);
+END;
+
+INSERT OR REPLACE INTO user_stats (user_id, recipe_count, rating_sum, rating_count, comment_count)
+SELECT r.user_id, COUNT(*), COALESCE(SUM(s.rating_sum), 0), COALESCE(SUM(s.rating_count), 0),
+       COALESCE(SUM(s.comment_count), 0)
+FROM recipes r
+         LEFT JOIN recipe_stats s ON s.recipe_id = r.id
+GROUP BY r.user_id;
+
+COMMIT;
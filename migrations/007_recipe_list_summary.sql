@@ -0,0 +1,59 @@
+-- Migration: add the list summary columns to recipes and the covering indexes the recipe lists read from
+-- Usage: sqlite3 database.db < migrations/007_recipe_list_summary.sql
+
+BEGIN TRANSACTION;
+
+ALTER TABLE recipes ADD COLUMN snippet TEXT;
+ALTER TABLE recipes ADD COLUMN ingredient_count INTEGER;
+ALTER TABLE recipes ADD COLUMN text_length INTEGER;
+
+-- Recipe list summaries: the first 140 characters of the ingredients, the number of ingredients
+-- (one per line, or separated by semicolons) and the length of ingredients plus directions
+CREATE TRIGGER IF NOT EXISTS recipes_summary_ai AFTER INSERT ON recipes BEGIN
+    UPDATE recipes
+    SET snippet          = CASE WHEN length(new.ingredients) > 140
+                                THEN substr(new.ingredients, 1, 140) || '…' ELSE new.ingredients END,
+        ingredient_count = CASE
+            WHEN trim(new.ingredients, char(9, 10, 13, 32, 59)) = '' THEN 0
+            WHEN instr(new.ingredients, char(10)) > 0
+                THEN length(trim(new.ingredients, char(9, 10, 13, 32)))
+                     - length(replace(trim(new.ingredients, char(9, 10, 13, 32)), char(10), '')) + 1
+            ELSE length(trim(new.ingredients, '; ')) - length(replace(trim(new.ingredients, '; '), ';', '')) + 1
+        END,
+        text_length      = length(new.ingredients) + length(new.directions)
+    WHERE id = new.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipes_summary_au AFTER UPDATE OF ingredients, directions ON recipes BEGIN
+    UPDATE recipes
+    SET snippet          = CASE WHEN length(new.ingredients) > 140
+                                THEN substr(new.ingredients, 1, 140) || '…' ELSE new.ingredients END,
+        ingredient_count = CASE
+            WHEN trim(new.ingredients, char(9, 10, 13, 32, 59)) = '' THEN 0
+            WHEN instr(new.ingredients, char(10)) > 0
+                THEN length(trim(new.ingredients, char(9, 10, 13, 32)))
+                     - length(replace(trim(new.ingredients, char(9, 10, 13, 32)), char(10), '')) + 1
+            ELSE length(trim(new.ingredients, '; ')) - length(replace(trim(new.ingredients, '; '), ';', '')) + 1
+        END,
+        text_length      = length(new.ingredients) + length(new.directions)
+    WHERE id = new.id;
+END;
+
+UPDATE recipes
+SET snippet          = CASE WHEN length(ingredients) > 140
+                            THEN substr(ingredients, 1, 140) || '…' ELSE ingredients END,
+    ingredient_count = CASE
+        WHEN trim(ingredients, char(9, 10, 13, 32, 59)) = '' THEN 0
+        WHEN instr(ingredients, char(10)) > 0
+            THEN length(trim(ingredients, char(9, 10, 13, 32)))
+                 - length(replace(trim(ingredients, char(9, 10, 13, 32)), char(10), '')) + 1
+        ELSE length(trim(ingredients, '; ')) - length(replace(trim(ingredients, '; '), ';', '')) + 1
+    END,
+    text_length      = length(ingredients) + length(directions);
+
+CREATE INDEX IF NOT EXISTS idx_recipes_list ON recipes(id, name, category_id, snippet, ingredient_count, text_length);
+CREATE INDEX IF NOT EXISTS idx_recipes_category_list
+    ON recipes(category_id, id, name, snippet, ingredient_count, text_length);
+DROP INDEX IF EXISTS idx_recipes_category;
+
+COMMIT;
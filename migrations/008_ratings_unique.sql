@@ -0,0 +1,14 @@
+-- Migration: allow one rating per user and recipe, backing the rating upsert
+-- Usage: sqlite3 database.db < migrations/008_ratings_unique.sql
+-- Duplicate ratings are collapsed to the most recent one first (the stats triggers adjust the totals).
+
+BEGIN TRANSACTION;
+
+DELETE FROM ratings
+WHERE id NOT IN (SELECT MAX(id) FROM ratings GROUP BY recipe_id, user_id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_ratings_recipe_user_unique ON ratings(recipe_id, user_id);
+DROP INDEX IF EXISTS idx_ratings_recipe_user;
+DROP INDEX IF EXISTS idx_ratings_recipe;
+
+COMMIT;
@@ -0,0 +1,7 @@
+-- Migration: make usernames unique, used by the login lookup and the single-insert signup
+-- Usage: sqlite3 database.db < migrations/009_users_username_unique.sql
+-- Fails without changing anything if two accounts share a username; find them with
+--   SELECT username, COUNT(*) FROM users GROUP BY username HAVING COUNT(*) > 1;
+-- and rename or merge them first.
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users(username);
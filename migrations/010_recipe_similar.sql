@@ -0,0 +1,13 @@
+-- Migration: add the table holding each recipe's similar recipes
+-- Usage: sqlite3 database.db < migrations/010_recipe_similar.sql
+-- Then compute them for existing recipes with `flask rebuild-similar` (requires NumPy).
+
+CREATE TABLE IF NOT EXISTS recipe_similar (
+    recipe_id INTEGER NOT NULL,
+    similar_id INTEGER NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (recipe_id, similar_id),
+    FOREIGN KEY (recipe_id) REFERENCES recipes(id) ON DELETE CASCADE,
+    FOREIGN KEY (similar_id) REFERENCES recipes(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_recipe_similar_similar_id ON recipe_similar(similar_id);
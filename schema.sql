@@ -27,6 +27,11 @@ CREATE TABLE recipes (
     directions TEXT,
     user_id INTEGER,
     category_id INTEGER NOT NULL,
+    -- List summary, filled in by the recipes_summary_* triggers below
+    snippet TEXT,
+    ingredient_count INTEGER,
+    text_length INTEGER,
+    directions_snippet TEXT,
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
     FOREIGN KEY (category_id) REFERENCES categories(id) ON DELETE CASCADE
 );
@@ -54,18 +59,213 @@ CREATE TABLE recipe_images (
     recipe_id INTEGER PRIMARY KEY,
     image BLOB NOT NULL,
     mime_type TEXT,
+    content_hash TEXT,
     FOREIGN KEY (recipe_id) REFERENCES recipes(id) ON DELETE CASCADE
 );
 
--- Speed up filtering and joining recipes by category (used on /recipes with category filter)
-CREATE INDEX IF NOT EXISTS idx_recipes_category ON recipes(category_id);
+-- Resized covers (thumb, medium) generated from recipe_images after upload
+CREATE TABLE IF NOT EXISTS recipe_image_variants (
+    recipe_id INTEGER NOT NULL,
+    size TEXT NOT NULL,
+    image BLOB NOT NULL,
+    mime_type TEXT,
+    content_hash TEXT,
+    width INTEGER,
+    height INTEGER,
+    PRIMARY KEY (recipe_id, size),
+    FOREIGN KEY (recipe_id) REFERENCES recipe_images(recipe_id) ON DELETE CASCADE
+);
+
+-- Precomputed similar recipes (best matches by name and ingredients), maintained by similar.py;
+-- the primary key serves the detail page, the similar_id index the cascade when a recipe is deleted
+CREATE TABLE IF NOT EXISTS recipe_similar (
+    recipe_id INTEGER NOT NULL,
+    similar_id INTEGER NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (recipe_id, similar_id),
+    FOREIGN KEY (recipe_id) REFERENCES recipes(id) ON DELETE CASCADE,
+    FOREIGN KEY (similar_id) REFERENCES recipes(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_recipe_similar_similar_id ON recipe_similar(similar_id);
+
+-- Usernames are unique; serves the login lookup and makes signup a single insert
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users(username);
+
+-- Covering indexes for the recipe lists, so listing never reads the ingredients and directions:
+-- by id (newest first, and id lookups from search and the top recipes) and by category then id
+CREATE INDEX IF NOT EXISTS idx_recipes_list
+    ON recipes(id, name, category_id, snippet, directions_snippet, ingredient_count, text_length);
+CREATE INDEX IF NOT EXISTS idx_recipes_category_list
+    ON recipes(category_id, id, name, snippet, directions_snippet, ingredient_count, text_length);
 
 -- Speed up fetching a user's recipes (used on /account and for authorization checks)
 CREATE INDEX IF NOT EXISTS idx_recipes_user ON recipes(user_id);
 
--- Speed up average/rating lookups and updates per recipe, and uniqueness checks by (recipe_id, user_id)
-CREATE INDEX IF NOT EXISTS idx_ratings_recipe ON ratings(recipe_id);
-CREATE INDEX IF NOT EXISTS idx_ratings_recipe_user ON ratings(recipe_id, user_id);
+-- One rating per user and recipe; backs the rating upsert and serves lookups by recipe
+CREATE UNIQUE INDEX IF NOT EXISTS idx_ratings_recipe_user_unique ON ratings(recipe_id, user_id);
+
+-- Speed up listing (newest first, paged by id) and deleting comments per recipe
+CREATE INDEX IF NOT EXISTS idx_comments_recipe_id ON comments(recipe_id, id);
+
+-- Full-text index over the searchable recipe columns (used on /recipes search), kept in sync by triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS recipes_fts USING fts5(
+    name,
+    ingredients,
+    directions,
+    content='recipes',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS recipes_fts_ai AFTER INSERT ON recipes BEGIN
+    INSERT INTO recipes_fts (rowid, name, ingredients, directions)
+    VALUES (new.id, new.name, new.ingredients, new.directions);
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipes_fts_ad AFTER DELETE ON recipes BEGIN
+    INSERT INTO recipes_fts (recipes_fts, rowid, name, ingredients, directions)
+    VALUES ('delete', old.id, old.name, old.ingredients, old.directions);
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipes_fts_au AFTER UPDATE OF name, ingredients, directions ON recipes BEGIN
+    INSERT INTO recipes_fts (recipes_fts, rowid, name, ingredients, directions)
+    VALUES ('delete', old.id, old.name, old.ingredients, old.directions);
+    INSERT INTO recipes_fts (rowid, name, ingredients, directions)
+    VALUES (new.id, new.name, new.ingredients, new.directions);
+END;
+
+-- Recipe list summaries: the first 140 characters of the ingredients and of the directions, the number
+-- of ingredients (one per line, or separated by semicolons) and the length of ingredients plus directions
+CREATE TRIGGER IF NOT EXISTS recipes_summary_ai AFTER INSERT ON recipes BEGIN
+    UPDATE recipes
+    SET snippet            = CASE WHEN length(new.ingredients) > 140
+                                  THEN substr(new.ingredients, 1, 140) || '…' ELSE new.ingredients END,
+        directions_snippet = CASE WHEN length(new.directions) > 140
+                                  THEN substr(new.directions, 1, 140) || '…' ELSE new.directions END,
+        ingredient_count   = CASE
+            WHEN trim(new.ingredients, char(9, 10, 13, 32, 59)) = '' THEN 0
+            WHEN instr(new.ingredients, char(10)) > 0
+                THEN length(trim(new.ingredients, char(9, 10, 13, 32)))
+                     - length(replace(trim(new.ingredients, char(9, 10, 13, 32)), char(10), '')) + 1
+            ELSE length(trim(new.ingredients, '; ')) - length(replace(trim(new.ingredients, '; '), ';', '')) + 1
+        END,
+        text_length        = length(new.ingredients) + length(new.directions)
+    WHERE id = new.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipes_summary_au AFTER UPDATE OF ingredients, directions ON recipes BEGIN
+    UPDATE recipes
+    SET snippet            = CASE WHEN length(new.ingredients) > 140
+                                  THEN substr(new.ingredients, 1, 140) || '…' ELSE new.ingredients END,
+        directions_snippet = CASE WHEN length(new.directions) > 140
+                                  THEN substr(new.directions, 1, 140) || '…' ELSE new.directions END,
+        ingredient_count   = CASE
+            WHEN trim(new.ingredients, char(9, 10, 13, 32, 59)) = '' THEN 0
+            WHEN instr(new.ingredients, char(10)) > 0
+                THEN length(trim(new.ingredients, char(9, 10, 13, 32)))
+                     - length(replace(trim(new.ingredients, char(9, 10, 13, 32)), char(10), '')) + 1
+            ELSE length(trim(new.ingredients, '; ')) - length(replace(trim(new.ingredients, '; '), ';', '')) + 1
+        END,
+        text_length        = length(new.ingredients) + length(new.directions)
+    WHERE id = new.id;
+END;
+
+-- Per-recipe rating and comment aggregates, kept current by triggers so listings never aggregate ratings
+CREATE TABLE IF NOT EXISTS recipe_stats (
+    recipe_id     INTEGER PRIMARY KEY,
+    rating_sum    INTEGER NOT NULL DEFAULT 0,
+    rating_count  INTEGER NOT NULL DEFAULT 0,
+    comment_count INTEGER NOT NULL DEFAULT 0,
+    avg_rating    REAL GENERATED ALWAYS AS (
+        CASE WHEN rating_count > 0 THEN CAST(rating_sum AS REAL) / rating_count ELSE 0 END
+    ) VIRTUAL,
+    FOREIGN KEY (recipe_id) REFERENCES recipes(id) ON DELETE CASCADE
+);
+
+-- Serves the top recipes on / straight from the index
+CREATE INDEX IF NOT EXISTS idx_recipe_stats_top ON recipe_stats(avg_rating DESC, rating_count DESC, recipe_id DESC);
+
+CREATE TRIGGER IF NOT EXISTS recipe_stats_recipe_ai AFTER INSERT ON recipes BEGIN
+    INSERT OR IGNORE INTO recipe_stats (recipe_id) VALUES (new.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipe_stats_rating_ai AFTER INSERT ON ratings BEGIN
+    INSERT INTO recipe_stats (recipe_id, rating_sum, rating_count) VALUES (new.recipe_id, new.rating, 1)
+    ON CONFLICT (recipe_id) DO UPDATE SET rating_sum   = rating_sum + excluded.rating_sum,
+                                          rating_count = rating_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipe_stats_rating_au AFTER UPDATE OF rating, recipe_id ON ratings BEGIN
+    UPDATE recipe_stats SET rating_sum = rating_sum - old.rating, rating_count = rating_count - 1
+    WHERE recipe_id = old.recipe_id;
+    INSERT INTO recipe_stats (recipe_id, rating_sum, rating_count) VALUES (new.recipe_id, new.rating, 1)
+    ON CONFLICT (recipe_id) DO UPDATE SET rating_sum   = rating_sum + excluded.rating_sum,
+                                          rating_count = rating_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipe_stats_rating_ad AFTER DELETE ON ratings BEGIN
+    UPDATE recipe_stats SET rating_sum = rating_sum - old.rating, rating_count = rating_count - 1
+    WHERE recipe_id = old.recipe_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipe_stats_comment_ai AFTER INSERT ON comments BEGIN
+    INSERT INTO recipe_stats (recipe_id, comment_count) VALUES (new.recipe_id, 1)
+    ON CONFLICT (recipe_id) DO UPDATE SET comment_count = comment_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS recipe_stats_comment_ad AFTER DELETE ON comments BEGIN
+    UPDATE recipe_stats SET comment_count = comment_count - 1 WHERE recipe_id = old.recipe_id;
+END;
+
+-- Per-author totals for /account (recipes written, ratings and comments received), kept current by triggers
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id       INTEGER PRIMARY KEY,
+    recipe_count  INTEGER NOT NULL DEFAULT 0,
+    rating_sum    INTEGER NOT NULL DEFAULT 0,
+    rating_count  INTEGER NOT NULL DEFAULT 0,
+    comment_count INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+CREATE TRIGGER IF NOT EXISTS user_stats_recipe_ai AFTER INSERT ON recipes BEGIN
+    INSERT INTO user_stats (user_id, recipe_count) VALUES (new.user_id, 1)
+    ON CONFLICT (user_id) DO UPDATE SET recipe_count = recipe_count + 1;
+END;
+
+-- BEFORE so the recipe's totals can still be read; the cascaded rating and comment
+-- deletes that follow no longer find the recipe and leave user_stats alone
+CREATE TRIGGER IF NOT EXISTS user_stats_recipe_bd BEFORE DELETE ON recipes BEGIN
+    UPDATE user_stats
+    SET recipe_count  = recipe_count - 1,
+        rating_sum    = rating_sum - COALESCE((SELECT rating_sum FROM recipe_stats WHERE recipe_id = old.id), 0),
+        rating_count  = rating_count - COALESCE((SELECT rating_count FROM recipe_stats WHERE recipe_id = old.id), 0),
+        comment_count = comment_count - COALESCE((SELECT comment_count FROM recipe_stats WHERE recipe_id = old.id), 0)
+    WHERE user_id = old.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_rating_ai AFTER INSERT ON ratings BEGIN
+    UPDATE user_stats SET rating_sum = rating_sum + new.rating, rating_count = rating_count + 1
+    WHERE user_id = (SELECT user_id FROM recipes WHERE id = new.recipe_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_rating_au AFTER UPDATE OF rating, recipe_id ON ratings BEGIN
+    UPDATE user_stats SET rating_sum = rating_sum - old.rating, rating_count = rating_count - 1
+    WHERE user_id = (SELECT user_id FROM recipes WHERE id = old.recipe_id);
+    UPDATE user_stats SET rating_sum = rating_sum + new.rating, rating_count = rating_count + 1
+    WHERE user_id = (SELECT user_id FROM recipes WHERE id = new.recipe_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_rating_ad AFTER DELETE ON ratings BEGIN
+    UPDATE user_stats SET rating_sum = rating_sum - old.rating, rating_count = rating_count - 1
+    WHERE user_id = (SELECT user_id FROM recipes WHERE id = old.recipe_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_comment_ai AFTER INSERT ON comments BEGIN
+    UPDATE user_stats SET comment_count = comment_count + 1
+    WHERE user_id = (SELECT user_id FROM recipes WHERE id = new.recipe_id);
+END;
 
--- Speed up listing and deleting comments per recipe
-CREATE INDEX IF NOT EXISTS idx_comments_recipe ON comments(recipe_id);
+CREATE TRIGGER IF NOT EXISTS user_stats_comment_ad AFTER DELETE ON comments BEGIN
+    UPDATE user_stats SET comment_count = comment_count - 1
+    WHERE user_id = (SELECT user_id FROM recipes WHERE id = old.recipe_id);
+END;
@@ -0,0 +1,328 @@
+"""
+"Similar recipes" for the detail page. Every recipe's name and ingredients become a
+TF-IDF vector over hashed words, held in memory as a sparse matrix (NumPy arrays in
+CSR form plus an inverted index). The top SIMILAR_COUNT neighbours by cosine
+similarity are stored in recipe_similar, so the page reads them with one primary key
+lookup.
+
+    flask rebuild-similar
+
+recomputes every list in batched, vectorized passes. After that, creating or editing
+a recipe queues an incremental update on a background thread: the recipe's own list
+is recomputed, and the recipe is added to the lists of the recipes it now ranks
+highly for. The IDF weights are those of the last full build, and an edited recipe
+can drop out of another recipe's list before a better one replaces it, so rebuild
+now and then (e.g. nightly) to keep the lists exact.
+
+NumPy is optional (pip install numpy). Without it nothing is computed and the detail
+page shows no similar recipes.
+"""
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from helpers import create_connection, close_connection, recipe_cache, run_query, run_write
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, similar recipes are then not computed
+    np = None
+
+SIMILAR_COUNT = 6
+# Pairs scoring below this are not worth showing
+MIN_SIMILARITY = 0.1
+# Words are hashed into this many buckets, so no vocabulary has to be kept
+VECTOR_DIM = 2 ** 18
+# A word in the recipe name counts as this many occurrences in the ingredients
+NAME_WEIGHT = 2.0
+# Words in more than this share of recipes (salt, oil, ...) are ignored once there are
+# MAX_DF_MIN_RECIPES recipes; they say little about similarity and have the longest postings
+MAX_DF_RATIO = 0.2
+MAX_DF_MIN_RECIPES = 1000
+# Upper bound on the cells of one dense score block (rows x recipes) in a full build
+SCORE_BLOCK_CELLS = 32 * 1024 * 1024
+# Recipes a new or edited recipe may be added to (its own best matches)
+REVERSE_CANDIDATES = 50
+# Incremental updates kept outside the matrix before it is rebuilt from the database
+MAX_DELTA_ROWS = 1000
+MAX_PENDING_UPDATES = 64
+READ_FETCH_SIZE = 5000
+
+_TOKEN = re.compile(r"[a-z]{3,}")
+STOP_WORDS = frozenset("""
+    and the with for from into cup cups tbsp tsp teaspoon teaspoons tablespoon tablespoons gram grams
+    ounce ounces pound pounds pinch large small medium fresh chopped sliced diced minced optional taste
+""".split())
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="similar")
+_pending = threading.BoundedSemaphore(MAX_PENDING_UPDATES)
+_index = None
+
+
+def term_counts(name, ingredients):
+    """Returns {hashed word: weighted count} for a recipe's name and ingredients."""
+    counts = {}
+    for text, weight in ((name, NAME_WEIGHT), (ingredients, 1.0)):
+        for word in _TOKEN.findall((text or "").lower()):
+            if word not in STOP_WORDS:
+                term = zlib.crc32(word.encode()) % VECTOR_DIM
+                counts[term] = counts.get(term, 0.0) + weight
+    return counts
+
+
+def read_recipes(min_id=0):
+    """Yields (id, name, ingredients) in id order without loading the table at once."""
+    db = create_connection()
+    try:
+        cursor = db.execute("SELECT id, name, ingredients FROM recipes WHERE id > ? ORDER BY id", [min_id])
+        while batch := cursor.fetchmany(READ_FETCH_SIZE):
+            yield from batch
+    finally:
+        close_connection(db)
+
+
+class SimilarityIndex:
+    """
+    TF-IDF vectors of all recipes. The bulk lives in a CSR matrix (indptr, indices,
+    data) with an inverted index (post_ptr, post_rows, post_data) for scoring;
+    recipes added or edited since the build are kept in a small delta and their old
+    row, if any, is masked out.
+    """
+
+    def __init__(self, recipes):
+        ids, indptr, indices, counts = [], [0], [], []
+        for recipe_id, name, ingredients in recipes:
+            terms = term_counts(name, ingredients)
+            ids.append(recipe_id)
+            indices.extend(terms)
+            counts.extend(terms.values())
+            indptr.append(len(indices))
+        self.ids = np.array(ids, dtype=np.int64)
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int32)
+        n = len(ids)
+
+        df = np.bincount(self.indices, minlength=VECTOR_DIM)
+        self.idf = (np.log((1 + n) / (1 + df)) + 1).astype(np.float32)
+        if n >= MAX_DF_MIN_RECIPES:
+            self.idf[df > MAX_DF_RATIO * n] = 0
+        self.data = (1 + np.log(np.array(counts, dtype=np.float32))) * self.idf[self.indices]
+        rows = np.repeat(np.arange(n), np.diff(self.indptr))
+        norms = np.sqrt(np.bincount(rows, weights=self.data ** 2, minlength=n))
+        self.data /= np.maximum(norms, 1e-12)[rows]
+
+        order = np.argsort(self.indices, kind="stable")
+        self.post_rows = rows[order].astype(np.int32)
+        self.post_data = self.data[order]
+        self.post_ptr = np.searchsorted(self.indices[order], np.arange(VECTOR_DIM + 1))
+        self.alive = np.ones(n, dtype=bool)
+        self.delta = {}
+
+    def __len__(self):
+        return int(self.alive.sum()) + len(self.delta)
+
+    def vectorize(self, name, ingredients):
+        """Returns (terms, weights) of a unit-length vector, weighted with the build's IDF."""
+        counts = term_counts(name, ingredients)
+        terms = np.array(sorted(counts), dtype=np.int32)
+        weights = (1 + np.log(np.array([counts[t] for t in terms], dtype=np.float32))) * self.idf[terms]
+        norm = np.sqrt(np.dot(weights, weights))
+        return terms, weights / norm if norm else weights
+
+    def _row(self, recipe_id):
+        position = np.searchsorted(self.ids, recipe_id)
+        if position < len(self.ids) and self.ids[position] == recipe_id:
+            return int(position)
+        return None
+
+    def upsert(self, recipe_id, name, ingredients):
+        self.remove(recipe_id)
+        self.delta[recipe_id] = self.vectorize(name, ingredients)
+
+    def remove(self, recipe_id):
+        row = self._row(recipe_id)
+        if row is not None:
+            self.alive[row] = False
+        self.delta.pop(recipe_id, None)
+
+    def score_block(self, start, stop):
+        """
+        Scores matrix rows start..stop against every row, as a dense (stop - start) x n
+        block. Only the terms that occur in the block matter, so it is a dense product of
+        the block's rows and those terms' posting lists, a chunk of terms at a time.
+        """
+        n = len(self.ids)
+        block = np.zeros((stop - start, n), dtype=np.float32)
+        lo, hi = self.indptr[start], self.indptr[stop]
+        rows = np.repeat(np.arange(stop - start), np.diff(self.indptr[start:stop + 1]))
+        block_terms, columns = np.unique(self.indices[lo:hi], return_inverse=True)
+        weights = self.data[lo:hi]
+        chunk = max(1, SCORE_BLOCK_CELLS // max(n, 1))
+        for first in range(0, len(block_terms), chunk):
+            terms = block_terms[first:first + chunk]
+            selected = (columns >= first) & (columns < first + len(terms))
+            query = np.zeros((stop - start, len(terms)), dtype=np.float32)
+            query[rows[selected], columns[selected] - first] = weights[selected]
+            postings = np.zeros((len(terms), n), dtype=np.float32)
+            for i, term in enumerate(terms):
+                entries = slice(self.post_ptr[term], self.post_ptr[term + 1])
+                postings[i, self.post_rows[entries]] = self.post_data[entries]
+            block += query @ postings
+        block[:, ~self.alive] = 0
+        block[np.arange(stop - start), np.arange(start, stop)] = 0
+        return block
+
+    def score(self, terms, weights):
+        """Scores one vector against every recipe; returns (ids, scores)."""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term, weight in zip(terms, weights):
+            postings = slice(self.post_ptr[term], self.post_ptr[term + 1])
+            scores[self.post_rows[postings]] += weight * self.post_data[postings]
+        scores[~self.alive] = 0
+        if not self.delta:
+            return self.ids, scores
+        delta_scores = []
+        for delta_terms, delta_weights in self.delta.values():
+            _, mine, theirs = np.intersect1d(terms, delta_terms, assume_unique=True, return_indices=True)
+            delta_scores.append(np.dot(weights[mine], delta_weights[theirs]))
+        return (np.concatenate([self.ids, np.fromiter(self.delta, dtype=np.int64)]),
+                np.concatenate([scores, np.array(delta_scores, dtype=np.float32)]))
+
+
+def top_neighbours(ids, scores, count):
+    """
+    Picks the count best (id, score) pairs of each row of scores (2-D) above
+    MIN_SIMILARITY, best first.
+    """
+    count = min(count, scores.shape[1])
+    if count == 0:
+        return [[] for _ in range(scores.shape[0])]
+    best = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(-best_scores, axis=1)
+    best = np.take_along_axis(best, order, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    return [[(int(ids[i]), float(s)) for i, s in zip(row, row_scores) if s >= MIN_SIMILARITY]
+            for row, row_scores in zip(best, best_scores)]
+
+
+def store_lists(lists):
+    """Replaces the stored neighbours of each recipe in {recipe_id: [(similar_id, score)]}."""
+    def store(db):
+        db.executemany("DELETE FROM recipe_similar WHERE recipe_id = ?", [[recipe_id] for recipe_id in lists])
+        db.executemany("INSERT INTO recipe_similar (recipe_id, similar_id, score) VALUES (?, ?, ?)",
+                       [(recipe_id, similar_id, score)
+                        for recipe_id, neighbours in lists.items() for similar_id, score in neighbours])
+
+    run_write(store)
+
+
+def build_similar():
+    """Builds a fresh index and recomputes every stored list; returns the index."""
+    index = SimilarityIndex(read_recipes())
+    n = len(index.ids)
+    block_rows = max(1, SCORE_BLOCK_CELLS // max(n, 1))
+    for start in range(0, n, block_rows):
+        stop = min(n, start + block_rows)
+        lists = top_neighbours(index.ids, index.score_block(start, stop), SIMILAR_COUNT)
+        store_lists(dict(zip(index.ids[start:stop].tolist(), lists)))
+        click.echo(f"\r  recipes: {stop}/{n}", nl=False, err=True)
+    click.echo("", err=True)
+    return index
+
+
+def get_index():
+    """The in-memory index, built on first use and rebuilt once the delta grows too large."""
+    global _index
+    if _index is None or len(_index.delta) > MAX_DELTA_ROWS:
+        _index = SimilarityIndex(read_recipes())
+    else:
+        # Recipes created by other processes since the build
+        known = max(int(_index.ids[-1]) if len(_index.ids) else 0, max(_index.delta, default=0))
+        for recipe_id, name, ingredients in read_recipes(known):
+            _index.upsert(recipe_id, name, ingredients)
+    return _index
+
+
+def update_similar(recipe_id):
+    """
+    Brings recipe_similar up to date after a recipe was created, edited or deleted.
+    Runs on the single background thread, which owns the in-memory index.
+    """
+    rows = run_query("SELECT name, ingredients FROM recipes WHERE id = ?", [recipe_id])
+    if not rows:
+        # Deleted: the foreign keys already removed its rows from recipe_similar
+        if _index is not None:
+            _index.remove(recipe_id)
+        return
+    index = get_index()
+    index.upsert(recipe_id, rows[0][0], rows[0][1])
+    ids, scores = index.score(*index.delta[recipe_id])
+    scores[ids == recipe_id] = 0
+    neighbours = top_neighbours(ids, scores[np.newaxis, :], max(SIMILAR_COUNT, REVERSE_CANDIDATES))[0]
+
+    def store(db):
+        db.execute("DELETE FROM recipe_similar WHERE recipe_id = ? OR similar_id = ?", [recipe_id, recipe_id])
+        db.executemany("INSERT INTO recipe_similar (recipe_id, similar_id, score) "
+                       "SELECT ?, id, ? FROM recipes WHERE id = ?",
+                       [(recipe_id, score, similar_id) for similar_id, score in neighbours[:SIMILAR_COUNT]])
+        # Join the lists of the best matches, then trim those lists back to SIMILAR_COUNT
+        db.executemany("INSERT INTO recipe_similar (recipe_id, similar_id, score) "
+                       "SELECT id, ?, ? FROM recipes WHERE id = ?",
+                       [(recipe_id, score, similar_id) for similar_id, score in neighbours])
+        db.executemany(
+            """
+            DELETE FROM recipe_similar
+            WHERE recipe_id = ?1
+              AND similar_id NOT IN (SELECT similar_id FROM recipe_similar WHERE recipe_id = ?1
+                                     ORDER BY score DESC LIMIT ?2)
+            """, [(similar_id, SIMILAR_COUNT) for similar_id, _ in neighbours])
+
+    run_write(store)
+    for similar_id, _ in neighbours:
+        recipe_cache.invalidate(similar_id)
+    recipe_cache.invalidate(recipe_id)
+
+
+def schedule_similar(recipe_id):
+    """
+    Queues update_similar without blocking the caller. Nothing is queued when NumPy
+    is missing or MAX_PENDING_UPDATES are already waiting; `flask rebuild-similar`
+    catches those up.
+
+    :return: True if the update was queued.
+    :rtype: bool
+    """
+    if np is None or not _pending.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            update_similar(recipe_id)
+        finally:
+            _pending.release()
+
+    try:
+        _executor.submit(run)
+    except RuntimeError:
+        _pending.release()
+        return False
+    return True
+
+
+@click.command("rebuild-similar")
+def rebuild_similar_command():
+    """Recompute the similar recipes of every recipe."""
+    if np is None:
+        raise click.ClickException("NumPy is required to compute similar recipes (pip install numpy)")
+    started = time.perf_counter()
+    index = build_similar()
+    click.echo(f"Computed similar recipes for {len(index.ids)} recipe(s) in {time.perf_counter() - started:.1f}s")
+
+
+def init_app(app):
+    app.cli.add_command(rebuild_similar_command)